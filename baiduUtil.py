@@ -1,12 +1,27 @@
+import time
 import requests
-from helperType import pathType, itemType
+from helperType import pathType, itemType, linkType, lruCache, rateLimiter
 from driveInterface import *
 import urllib3
 import re
+from fnmatch import fnmatchcase
 import json
-from retrying import retry
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from panMirror import panMirror
+from panAsync import asyncTransport
+from uploadCache import uploadCache
 
 BAIDU_API_BASE = "https://pan.baidu.com/api/"
+BAIDU_SHARE_BASE = "https://pan.baidu.com/share/"
+# list 接口单页最多返回的项数 (默认值)
+PAGE_SIZE = 1000
+# 表示请求被限流的错误码, 以及单个请求的最多尝试次数
+THROTTLE_ERRNOS = (111, 31034)
+REQUEST_RETRIES = 5
+# filemanager 单次请求最多提交的项数, 超过 FILEMANAGER_SYNC_LIMIT 项时使用异步任务
+FILEMANAGER_BATCH_SIZE = 500
+FILEMANAGER_SYNC_LIMIT = 20
 
 REQUEST_HEADER = {
     "Host": "pan.baidu.com",
@@ -38,16 +53,135 @@ class Pan(driveInterface):
     session: requests.Session
     request_header: dict
     bdstoken: str
+    executor: ThreadPoolExecutor
+    dir_cache: lruCache
 
-    def __init__(self, base_path: pathType, cookies: str):
+    def __init__(
+        self,
+        base_path: pathType,
+        cookies: str,
+        workers: int = 8,
+        cache_ttl: float = 30,
+        cache_size: int = 1024,
+        mirror: str = None,
+        upload_workers: int = 16,
+        rate_limit: float = 100,
+        transport: str = "threads",
+        upload_cache: str = None,
+        upload_cache_ttl: float = 7 * 86400,
+        api_base: str = None,
+        share_base: str = None,
+        page_size: int = PAGE_SIZE,
+    ):
         urllib3.disable_warnings()
         self.session = requests.session()
         self.session.trust_env = False
+        # 并发请求共用同一会话, 连接池需容纳所有工作线程
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=max(int(workers), int(upload_workers)) * 2,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # 本驱动的所有工作线程共用一个限速器
+        self.limiter = rateLimiter(rate_limit)
+        self.workers = int(workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.upload_workers = int(upload_workers)
+        self.upload_executor = ThreadPoolExecutor(max_workers=self.upload_workers)
         self.base_path = base_path
         self.drive_type = "baidunetdisk"
+        # 接口地址可替换, 用于连接 fakeBaidu 等本地服务
+        self.api_base = api_base or BAIDU_API_BASE
+        self.share_base = share_base or BAIDU_SHARE_BASE
+        self.page_size = int(page_size)
         self.request_header = REQUEST_HEADER
         self.request_header["Cookie"] = cookies
         self.bdstoken = ""
+        # 目录列表缓存: 目录 -> (过期时间, 列表, 名称 -> 项), 由本驱动的写操作精确失效
+        self.cache_ttl = float(cache_ttl)
+        self.dir_cache = lruCache(int(cache_size))
+        self.cache_generation = 0
+        # 可选的秒传结果缓存, 跳过已知在服务器上不存在的哈希
+        self.upload_cache = (
+            uploadCache(upload_cache, upload_cache_ttl) if upload_cache else None
+        )
+        # transport 为 asyncio 时接口请求改由事件循环上的 aiohttp 执行, 不再占用线程
+        if transport == "asyncio":
+            self.transport = asyncTransport(
+                self, max(int(workers), int(upload_workers)) * 2
+            )
+        elif transport == "threads":
+            self.transport = None
+        else:
+            raise ValueError("Unknown transport: {}".format(transport))
+        # 可选的本地 SQLite 镜像, 刷新过后由镜像回答读取
+        self.mirror = panMirror(self, mirror) if mirror else None
+
+    def request(self, method: str, url: str, **kwargs) -> dict:
+        # 所有请求经由同一限速器; 遇到限流错误码或连接失败时退避后重试
+        kwargs.setdefault("timeout", 15)
+        kwargs.setdefault("allow_redirects", False)
+        for attempt in range(REQUEST_RETRIES):
+            self.limiter.acquire()
+            try:
+                res = self.session.request(
+                    method, url, headers=self.request_header, verify=False, **kwargs
+                ).json()
+            except requests.ConnectionError as e:
+                if attempt == REQUEST_RETRIES - 1:
+                    raise e
+                time.sleep(self.limiter.throttled())
+                continue
+            if res.get("errno") not in THROTTLE_ERRNOS:
+                self.limiter.succeeded()
+                return res
+            if attempt < REQUEST_RETRIES - 1:
+                time.sleep(self.limiter.throttled())
+        return res
+
+    def use_mirror(self) -> bool:
+        return self.mirror is not None and self.mirror.is_ready()
+
+    def mirror_apply(self, method: str, *args, **kwargs) -> None:
+        if self.mirror is not None:
+            self.mirror.apply(method, *args, **kwargs)
+
+    def dir_entry(self, path: str):
+        entry = self.dir_cache.get(path)
+        if entry is not None and entry[0] < time.monotonic():
+            self.dir_cache.pop(path)
+            return None
+        return entry
+
+    def cache_dir_list(self, path: str, items: list, generation: int) -> tuple:
+        entry = (
+            time.monotonic() + self.cache_ttl,
+            items,
+            {item["path"].rsplit("/", 1)[-1]: item for item in items},
+        )
+        # 列表期间若有写操作使缓存失效, 结果可能已过期, 不再放入缓存
+        if self.cache_ttl > 0 and generation == self.cache_generation:
+            self.dir_cache.put(path, entry)
+        return entry
+
+    def forget_dir(self, path: str) -> None:
+        # 目录自身及其下所有子目录的列表失效
+        self.cache_generation += 1
+        prefix = path.rstrip("/") + "/"
+        for key, _ in self.dir_cache.items():
+            if key == path or key.startswith(prefix):
+                self.dir_cache.pop(key)
+
+    def forget_new(self, path: str) -> None:
+        # 新建的项可能连带创建了中间目录, 向上失效到确知已存在的祖先为止
+        self.cache_generation += 1
+        while path != "/":
+            parent = path.rstrip("/").rsplit("/", 1)[0] or "/"
+            entry = self.dir_cache.pop(parent)
+            if entry is not None:
+                break
+            path = parent
 
     def item_to_itemType(self, item: dict, **kwargs) -> itemType:
         type = item["isdir"]
@@ -65,118 +199,341 @@ class Pan(driveInterface):
         res_item = itemType(path, type, data)
         return res_item
 
+    def call(self, gen):
+        # 执行接口调用生成器: 生成器产出请求 (method, url, kwargs) 或等待的秒数, 收到响应后继续, 返回值即结果
+        if self.transport is not None:
+            return self.transport.call(gen)
+        try:
+            step = next(gen)
+            while True:
+                try:
+                    if isinstance(step, tuple):
+                        res = self.request(step[0], step[1], **step[2])
+                    else:
+                        time.sleep(step)
+                        res = None
+                except Exception as e:
+                    step = gen.throw(e)
+                    continue
+                step = gen.send(res)
+        except StopIteration as e:
+            return e.value
+
+    def submit(self, gen, executor: ThreadPoolExecutor = None):
+        # 并发执行接口调用, 返回 concurrent.futures.Future
+        if self.transport is not None:
+            return self.transport.submit(gen)
+        return (executor or self.executor).submit(self.call, gen)
+
     def get_bdstoken(self) -> str:
-        payload = {
-            "clienttype": 0,
-            "app_id": 250528,
-            "web": 1,
-            "fields": '["bdstoken", "token", "uk", "isdocuser", "servertime"]',
-        }
-        response = self.session.get(
-            url=BAIDU_API_BASE + "gettemplatevariable",
-            headers=self.request_header,
-            timeout=20,
-            allow_redirects=True,
-            verify=False,
-            params=payload,
-        )
-        res = response.json()
-        if res["errno"] != 0:
-            raise driveError(res["errno"], res["errmsg"] if "errmsg" in res else "")
-        self.bdstoken = res["result"]["bdstoken"]
-        return res["result"]["bdstoken"]
+        self.bdstoken = ""
+        return self.call(self.api_bdstoken())
+
+    def api_bdstoken(self):
+        if not self.bdstoken:
+            payload = {
+                "clienttype": 0,
+                "app_id": 250528,
+                "web": 1,
+                "fields": '["bdstoken", "token", "uk", "isdocuser", "servertime"]',
+            }
+            res = (
+                yield "GET",
+                self.api_base + "gettemplatevariable",
+                {
+                    "timeout": 20,
+                    "allow_redirects": True,
+                    "params": payload,
+                },
+            )
+            if res["errno"] != 0:
+                raise driveError(res["errno"], res["errmsg"] if "errmsg" in res else "")
+            self.bdstoken = res["result"]["bdstoken"]
+        return self.bdstoken
 
     def get_dir_list(self, path: str) -> list:
+        return self.get_dir_entry(path)[1]
+
+    def get_dir_list_uncached(self, path: str) -> list:
+        return list(self.iter_dir_list(path))
+
+    def get_dir_entry(self, path: str) -> tuple:
+        entry = self.dir_entry(path)
+        if entry is None:
+            generation = self.cache_generation
+            entry = self.cache_dir_list(
+                path, list(self.iter_dir_list(path)), generation
+            )
+        return entry
+
+    def iter_dir_list(self, path: str):
+        # 接口不返回总数: 首页已满时, 并发预取其后 workers 页, 按页序产出, 遇到不满的页为止
+        items = self.get_dir_page(path, 1)
+        yield from items
+        if len(items) < self.page_size:
+            return
+        pending = deque()
+        page = 2
+        try:
+            while True:
+                while len(pending) < self.workers:
+                    pending.append(self.submit(self.api_list(path, page)))
+                    page += 1
+                items = pending.popleft().result()
+                yield from items
+                if len(items) < self.page_size:
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def get_dir_page(self, path: str, page: int = 1, num: int = None) -> list:
+        return self.call(self.api_list(path, page, num))
+
+    def api_list(self, path: str, page: int = 1, num: int = None):
         payload = {
             "order": "time",
             "desc": 1,
             "showempty": 0,
             "web": 1,
-            "page": 1,
-            "num": 1000,
+            "page": page,
+            "num": num or self.page_size,
             "dir": path,
-            "bdstoken": self.bdstoken or self.get_bdstoken(),
+            "bdstoken": (yield from self.api_bdstoken()),
         }
-        response = self.session.get(
-            url=BAIDU_API_BASE + "list",
-            headers=self.request_header,
-            timeout=15,
-            allow_redirects=False,
-            verify=False,
-            params=payload,
-        )
-        res = response.json()
+        res = yield "GET", self.api_base + "list", {"params": payload}
         if res["errno"] != 0:
             if res["errno"] == -9:
                 raise pathNotFoundError(
-                    self.get_absolute_path(
-                        pathType.path_from_str(path["path"].strip("/"))
-                    )
+                    self.get_absolute_path(pathType.path_from_str(path.strip("/")))
                 )
             else:
                 raise driveError(res["errno"], res["errmsg"] if "errmsg" in res else "")
         return res["list"]
 
     def rapid_upload(self, path: str, file_data: dict) -> None:
-        payload = {"bdstoken": self.bdstoken or self.get_bdstoken()}
+        try:
+            self.call(self.api_rapid_upload(path, file_data))
+        finally:
+            if self.upload_cache is not None:
+                self.upload_cache.flush()
+
+    def api_rapid_upload(self, path: str, file_data: dict):
+        # 服务器只接受小写的哈希, 统一转换后只请求一次; 已知不可秒传的哈希直接报告失败
+        file_data = {
+            "md5": file_data["md5"].lower(),
+            "md5_s": file_data["md5_s"].lower(),
+            "size": file_data["size"],
+        }
+        if self.upload_cache is not None and self.upload_cache.is_dead(file_data):
+            raise driveError(
+                404,
+                "Rapid-upload hash not found",
+                data={
+                    "path": self.get_absolute_path(
+                        pathType.path_from_str(path.strip("/"))
+                    ),
+                    "cached": True,
+                },
+            )
+        payload = {"bdstoken": (yield from self.api_bdstoken())}
         post_data = {
             "path": path,
             "content-md5": file_data["md5"],
             "slice-md5": file_data["md5_s"],
             "content-length": file_data["size"],
         }
-        response = self.session.post(
-            url=BAIDU_API_BASE + "rapidupload",
-            headers=self.request_header,
-            data=post_data,
-            timeout=15,
-            allow_redirects=False,
-            verify=False,
-            params=payload,
+        res = (
+            yield "POST",
+            self.api_base + "rapidupload",
+            {
+                "data": post_data,
+                "params": payload,
+            },
         )
-        if response.json()["errno"] == 404:
-            post_data = {
-                "path": path,
-                "content-md5": file_data["md5"].lower(),
-                "slice-md5": file_data["md5_s"].lower(),
-                "content-length": file_data["size"],
-            }
-            response = self.session.post(
-                url=BAIDU_API_BASE + "rapidupload",
-                headers=self.request_header,
-                data=post_data,
-                timeout=15,
-                allow_redirects=False,
-                verify=False,
-                params=payload,
+        if self.upload_cache is not None and res["errno"] in (0, 404):
+            self.upload_cache.record(file_data, res["errno"] == 0)
+        self.forget_new(path)
+        if res["errno"] == -8:
+            raise driveError(
+                603,
+                "Path already exists",
+                data={
+                    "path": self.get_absolute_path(
+                        pathType.path_from_str(path.strip("/"))
+                    )
+                },
             )
-        res = response.json()
-        if res["errno"] != 0:
+        elif res["errno"] == 404:
+            raise driveError(
+                404,
+                "Rapid-upload hash not found",
+                data={
+                    "path": self.get_absolute_path(
+                        pathType.path_from_str(path.strip("/"))
+                    )
+                },
+            )
+        elif res["errno"] != 0:
             raise driveError(res["errno"], res["errmsg"] if "errmsg" in res else "")
 
+    def rapid_upload_many(self, jobs):
+        # jobs 为 (key, 路径, file_data), 最多 upload_workers 个同时进行, 按输入顺序产出 (key, 错误或 None)
+        pending = deque()
+
+        def result():
+            key, future = pending.popleft()
+            try:
+                future.result()
+            except driveError as e:
+                return key, e
+            return key, None
+
+        try:
+            for key, path, file_data in jobs:
+                pending.append(
+                    (
+                        key,
+                        self.submit(
+                            self.api_rapid_upload(path, file_data),
+                            self.upload_executor,
+                        ),
+                    )
+                )
+                if len(pending) >= self.upload_workers:
+                    yield result()
+            while pending:
+                yield result()
+        finally:
+            for key, future in pending:
+                future.cancel()
+
     def create_dir(self, path: str) -> None:
-        url = BAIDU_API_BASE + "create"
-        payload = {"a": "commit", "bdstoken": self.bdstoken or self.get_bdstoken()}
+        self.call(self.api_create_dir(path))
+
+    def api_create_dir(self, path: str):
+        payload = {"a": "commit", "bdstoken": (yield from self.api_bdstoken())}
         post_data = {
             "path": path,
             "isdir": "1",
             "block_list": "[]",
         }
-        response = self.session.post(
-            url=url,
-            headers=self.request_header,
-            data=post_data,
-            timeout=15,
-            allow_redirects=False,
-            verify=False,
-            params=payload,
+        res = (
+            yield "POST",
+            self.api_base + "create",
+            {
+                "data": post_data,
+                "params": payload,
+            },
         )
-        res = response.json()
+        self.forget_new(path)
         if res["errno"] != 0:
             raise driveError(res["errno"], res["errmsg"] if "errmsg" in res else "")
 
+    def create_dirs(self, paths, **kwargs) -> list[pathType]:
+        # 批量 mkdir -p: 收集 paths 及其所有上级目录, 按深度逐级对照 (缺缓存时并行列出的) 上级目录列表,
+        # 同一级缺失的目录并行创建; 本次新建目录下的子目录必然缺失, 无需列出. 返回新建的目录
+        # report(path, error) 逐个报告创建失败的目录, 其下的目录不再处理; 未提供时直接抛出
+        report = kwargs["report"] if "report" in kwargs else None
+        levels = {}
+        for path in paths:
+            names = self.get_relative_path(path).path
+            if ".." in names:
+                raise driveError(600, "Not in Drives")
+            for depth in range(1, len(names) + 1):
+                levels.setdefault(depth, set()).add("/" + "/".join(names[:depth]))
+        created = set()
+        failed = set()
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+
+        def to_path(path: str) -> pathType:
+            return self.base_path + pathType.path_from_str(path, absolute=False)
+
+        def fail(path: str, error: driveError):
+            if report is None:
+                raise error
+            failed.add(path)
+            report(to_path(path), error)
+
+        try:
+            for depth in sorted(levels):
+                level = {}
+                for path in sorted(levels[depth]):
+                    level.setdefault(path.rsplit("/", 1)[0] or "/", []).append(path)
+                listings = {
+                    parent: pool.submit(self.get_dir_entry, parent)
+                    for parent in level
+                    if parent not in created and parent not in failed
+                }
+                missing = []
+                for parent, children in level.items():
+                    if parent in failed:
+                        failed.update(children)
+                        continue
+                    entries = listings[parent].result()[2] if parent in listings else {}
+                    for path in children:
+                        entry = entries.get(path.rsplit("/", 1)[1])
+                        if entry is None:
+                            missing.append(path)
+                        elif not entry["isdir"]:
+                            fail(
+                                path,
+                                driveError(
+                                    604,
+                                    "Not a directory",
+                                    data={"path": to_path(path)},
+                                ),
+                            )
+                futures = [
+                    (path, self.submit(self.api_create_dir(path), self.upload_executor))
+                    for path in missing
+                ]
+                errors = []
+                for path, future in futures:
+                    try:
+                        future.result()
+                        created.add(path)
+                    except driveError as e:
+                        # 并发写入时目录可能已被他处创建
+                        if e.code != -8:
+                            errors.append((path, e))
+                for path, error in errors:
+                    fail(path, error)
+        finally:
+            pool.shutdown(wait=False)
+            created = [to_path(path) for path in sorted(created)]
+            if created:
+                self.mirror_apply("bulk_add", [], path=self.base_path, dirs=created)
+        return created
+
     def search_file(self, dir: str, key: str, page: int = 1) -> list[itemType]:
-        url = BAIDU_API_BASE + "search"
+        return list(self.iter_search_file(dir, key, page))
+
+    def iter_search_file(self, dir: str, key: str, page: int = 1):
+        # 按页序产出; 每当 has_more 为 1 时预取的页数加倍, 最多同时预取 workers 页
+        res = self.get_search_page(dir, key, page)
+        pending = deque()
+        next_page = page + 1
+        ahead = 1
+        try:
+            while True:
+                for item in res["list"]:
+                    yield self.item_to_itemType(item)
+                if res["has_more"] != 1:
+                    break
+                while len(pending) < ahead:
+                    pending.append(self.submit(self.api_search(dir, key, next_page)))
+                    next_page += 1
+                ahead = min(ahead * 2, self.workers)
+                res = pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def get_search_page(self, dir: str, key: str, page: int) -> dict:
+        return self.call(self.api_search(dir, key, page))
+
+    def api_search(self, dir: str, key: str, page: int):
         payload = {
             "clienttype": 0,
             "app_id": 250528,
@@ -185,140 +542,275 @@ class Pan(driveInterface):
             "dir": dir,
             "page": page,
             "recursion": 1,
-            "bdstoken": self.bdstoken or self.get_bdstoken(),
+            "bdstoken": (yield from self.api_bdstoken()),
         }
-        response = self.session.get(
-            url=url,
-            headers=self.request_header,
-            timeout=15,
-            allow_redirects=False,
-            verify=False,
-            params=payload,
-        )
-        res = response.json()
+        res = yield "GET", self.api_base + "search", {"params": payload}
         if res["errno"] != 0:
             raise driveError(res["errno"], res["errmsg"] if "errmsg" in res else "")
-        res_list = []
-        for item in res["list"]:
-            res_list.append(self.item_to_itemType(item))
-        if res["has_more"] == 1:
-            res_list.extend(self.search_file(dir=dir, key=key, page=page + 1))
-        return res_list
-
-    @retry(
-        wait_fixed=1000,
-        stop_max_attempt_number=3,
-        retry_on_exception=lambda e: e.code == 111,
-    )
+        return res
+
     def file_manager(self, opera: str, filelist) -> None:
-        url = BAIDU_API_BASE + "filemanager"
+        self.call(self.api_file_manager(opera, filelist))
+
+    def api_file_manager(self, opera: str, filelist):
+        # 按 FILEMANAGER_BATCH_SIZE 分块提交, 全部完成后再报告失败的项; 第一项失败作为异常抛出
+        failures = []
+        for start in range(0, len(filelist), FILEMANAGER_BATCH_SIZE):
+            chunk = filelist[start : start + FILEMANAGER_BATCH_SIZE]
+            for attempt in range(3):
+                errnos = yield from self.api_file_manager_chunk(opera, chunk)
+                # 单项被限流时只重新提交这些项
+                retry_list = [
+                    file
+                    for file, errno in zip(chunk, errnos)
+                    if errno in THROTTLE_ERRNOS
+                ]
+                failures += [
+                    (file, errno)
+                    for file, errno in zip(chunk, errnos)
+                    if errno != 0 and errno not in THROTTLE_ERRNOS
+                ]
+                if not retry_list:
+                    break
+                chunk = retry_list
+                yield self.limiter.throttled()
+            else:
+                failures += [(file, 111) for file in retry_list]
+        if failures:
+            error = self.file_manager_error(*failures[0])
+            error.data = dict(error.data)
+            error.data["failures"] = [
+                {"path": file if type(file) == str else file["path"], "errno": errno}
+                for file, errno in failures
+            ]
+            raise error
+
+    def file_manager_error(self, file, errno: int) -> driveError:
+        src = file if type(file) == str else file["path"]
+        if errno == -9:
+            return pathNotFoundError(
+                self.get_absolute_path(pathType.path_from_str(src.strip("/")))
+            )
+        elif errno == -8:
+            return driveError(
+                603,
+                "Path already exists",
+                data={
+                    "path": self.get_absolute_path(
+                        pathType.path_from_str(file["dest"].strip("/"))
+                        + pathType([file["newname"]], False)
+                    )
+                },
+            )
+        elif errno in THROTTLE_ERRNOS:
+            return RetryLater()
+        else:
+            return driveError(
+                errno,
+                "",
+                data={
+                    "path": self.get_absolute_path(
+                        pathType.path_from_str(src.strip("/"))
+                    )
+                },
+            )
+
+    def api_file_manager_chunk(self, opera: str, filelist: list):
+        # 提交一块, 返回每项的 errno; 较大的块使用异步任务并轮询其结果
+        use_async = len(filelist) > FILEMANAGER_SYNC_LIMIT
         payload = {
-            "async": 0,
+            "async": 2 if use_async else 0,
             "onnest": "fail",
             "opera": opera,
             "clienttype": 0,
             "app_id": 250528,
             "web": 1,
-            "bdstoken": self.bdstoken or self.get_bdstoken(),
+            "bdstoken": (yield from self.api_bdstoken()),
         }
         post_data = {"filelist": json.dumps(filelist, ensure_ascii=False)}
-        response = self.session.post(
-            url=url,
-            headers=self.request_header,
-            data=post_data,
-            timeout=15,
-            allow_redirects=False,
-            verify=False,
-            params=payload,
-        )
-        res = response.json()
-        if res["errno"] == 12:
-            for i in range(len(res["info"])):
-                if res["info"][i]["errno"] == -9:
-                    raise pathNotFoundError(
-                        self.get_absolute_path(
-                            pathType.path_from_str(res["info"][i]["path"].strip("/"))
-                        )
-                    )
-                elif res["info"][i]["errno"] == -8:
-                    raise driveError(
-                        603,
-                        "Path already exists",
-                        data={
-                            "path": self.get_absolute_path(
-                                pathType.path_from_str(filelist[i]["dest"].strip("/"))
-                                + pathType([filelist[i]["newname"]], False)
-                            )
-                        },
-                    )
-                elif res["info"][i]["errno"] == 111:
-                    raise RetryLater()
-                else:
-                    raise driveError(
-                        res["errno"],
-                        res["errmsg"] if "errmsg" in res else "",
-                        data={"res": res},
-                    )
-        elif res["errno"] != 0:
+        try:
+            res = (
+                yield "POST",
+                self.api_base + "filemanager",
+                {
+                    "data": post_data,
+                    "params": payload,
+                },
+            )
+            if use_async and res["errno"] == 0:
+                res = yield from self.api_wait_task(res["taskid"])
+        finally:
+            # 部分成功时也可能已有变化, 无论结果如何都使相关目录失效
+            for file in filelist:
+                src = file if type(file) == str else file["path"]
+                if opera in ("delete", "move"):
+                    self.forget_dir(src)
+                    self.forget_dir(src.rstrip("/").rsplit("/", 1)[0] or "/")
+                if opera in ("copy", "move"):
+                    self.forget_new(file["dest"].rstrip("/") + "/" + file["newname"])
+        if res["errno"] == 0:
+            return [0] * len(filelist)
+        elif res["errno"] == 12 and len(res["info"]) == len(filelist):
+            return [info["errno"] for info in res["info"]]
+        elif res["errno"] in THROTTLE_ERRNOS:
+            raise RetryLater()
+        else:
             raise driveError(
                 res["errno"],
                 res["errmsg"] if "errmsg" in res else "",
                 data={"res": res},
             )
 
+    def api_wait_task(self, taskid):
+        # 轮询异步任务, 结果整理为与同步请求相同的形式
+        interval = 0.2
+        while True:
+            res = (
+                yield "GET",
+                self.share_base + "taskquery",
+                {
+                    "params": {
+                        "taskid": taskid,
+                        "clienttype": 0,
+                        "app_id": 250528,
+                        "web": 1,
+                    }
+                },
+            )
+            if res["errno"] in THROTTLE_ERRNOS:
+                # 查询被限流时任务仍在进行, 稍后继续轮询
+                res["status"] = "running"
+            elif res["errno"] != 0:
+                return res
+            if res["status"] == "success":
+                return {"errno": 0}
+            elif res["status"] == "failed":
+                return {
+                    "errno": res["task_errno"] if "task_errno" in res else 12,
+                    "info": res["list"] if "list" in res else [],
+                }
+            yield interval
+            interval = min(interval * 2, 2)
+
     # 实现driveInterface接口方法
     def list_dir(self, path: pathType) -> list[itemType]:
+        return list(self.iter_dir(path))
+
+    def iter_dir(self, path: pathType):
+        if self.use_mirror():
+            yield from self.mirror.iter_dir(path)
+            return
         r_path = self.get_relative_path(path)
-        res_list = []
-        items = self.get_dir_list("/" + str(r_path))
+        dir = "/" + str(r_path)
+        entry = self.dir_entry(dir)
+        if entry is not None:
+            items = entry[1]
+        else:
+            generation = self.cache_generation
+            items = []
+            for item in self.iter_dir_list(dir):
+                items.append(item)
+                yield self.item_to_itemType(item)
+            self.cache_dir_list(dir, items, generation)
+            return
         for item in items:
-            res_list.append(self.item_to_itemType(item))
-        return res_list
+            yield self.item_to_itemType(item)
+
+    def walk(self, path, max_depth: int = None, include: list = None, exclude=None):
+        # 广度优先并行列出目录, 每个目录的列表到达后立即产出其中的项
+        # 使用单独的线程池: 列出目录时的分页预取会占用 executor, 共用会互相等待
+        if self.use_mirror():
+            for item in self.mirror.db.walk(path, max_depth, include, exclude):
+                yield self.mirror.to_pan_item(item)
+            return
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        pending = {}
+
+        def list_dir(dir: pathType, depth: int):
+            pending[
+                pool.submit(self.get_dir_list, "/" + str(self.get_relative_path(dir)))
+            ] = depth
+
+        try:
+            for root in path if type(path) == list else [path]:
+                list_dir(root, 1)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    depth = pending.pop(future)
+                    try:
+                        items = future.result()
+                    except pathNotFoundError:
+                        continue
+                    for item in items:
+                        item = self.item_to_itemType(item)
+                        if exclude and match_name(item.name, exclude):
+                            continue
+                        if item.type == 1 and (max_depth is None or depth < max_depth):
+                            list_dir(item.path, depth + 1)
+                        if not include or match_name(item.name, include):
+                            yield item
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
 
     def get_item(self, path: pathType) -> itemType:
         if path == self.base_path:
             return itemType(path, 1, data={})
-        items = self.list_dir(path.dirname)
-        for item in items:
-            if item.path.basename == path.basename:
-                return item
+        if self.use_mirror():
+            return self.mirror.get_item(path)
+        r_path = self.get_relative_path(path)
+        names = self.get_dir_entry("/" + str(r_path.dirname))[2]
+        if path.basename in names:
+            return self.item_to_itemType(names[path.basename])
         raise pathNotFoundError(path)
 
     def search_items(self, **kwargs) -> list[itemType]:
-        import sys
+        return list(self.iter_search_items(**kwargs))
 
-        if "name" not in kwargs:
-            sys.stdout.write(
-                "baiduUtil : -name not specified. Search files in Baidu Netdisk without parameter '-name' is not supported.\n"
-            )
-            return []
-        sys.stdout.write(
-            "baiduUtil : Search files in Baidu Netdisk will ignore wildcards and return items with specific name.\n"
-        )
-        dir_list = []
-        res_list = []
+    def iter_search_items(self, **kwargs):
+        if self.use_mirror():
+            yield from self.mirror.iter_search_items(**kwargs)
+            return
+        path_list = []
         if "path" in kwargs and kwargs["path"]:
             if type(kwargs["path"]) == type([]):
-                for path in kwargs["path"]:
-                    dir_list.append(self.get_relative_path(path))
+                path_list.extend(kwargs["path"])
             else:
-                dir_list.append(self.get_relative_path(kwargs["path"]))
+                path_list.append(kwargs["path"])
         else:
-            dir_list.append(pathType.path_from_str(""))
-        for dir in dir_list:
-            name_without_wildcards = (
-                re.sub(r"\[.*?\]", "", kwargs["name"]).replace("*", "").replace("?", "")
+            path_list.append(self.base_path)
+        # 以通配符之间最长的一段作为搜索关键字, 返回的项再按完整的通配符过滤 (不区分大小写)
+        pattern = kwargs["name"].lower() if "name" in kwargs else None
+        key = max(re.split(r"\[.*?\]|[*?]", pattern), key=len) if pattern else ""
+        if key:
+            items = (
+                item
+                for path in path_list
+                for item in self.iter_search_file(
+                    "/" + str(self.get_relative_path(path)), key
+                )
             )
-            items = self.search_file("/" + str(dir), name_without_wildcards)
-            for item in items:
-                if "type" in kwargs and item.type != kwargs["type"]:
-                    continue
-                if "max_size" in kwargs and item.data["size"] > kwargs["max_size"]:
-                    continue
-                if "min_size" in kwargs and item.data["size"] < kwargs["min_size"]:
-                    continue
-                res_list.append(item)
-        return res_list
+        else:
+            # 没有可用的关键字时遍历整个目录树
+            items = self.walk(path_list)
+        for item in items:
+            if pattern and not fnmatchcase(item.name.lower(), pattern):
+                continue
+            if "type" in kwargs and item.type != kwargs["type"]:
+                continue
+            if (
+                "max_size" in kwargs
+                and int(item.data["size"] or 0) > kwargs["max_size"]
+            ):
+                continue
+            if (
+                "min_size" in kwargs
+                and int(item.data["size"] or 0) < kwargs["min_size"]
+            ):
+                continue
+            yield item
 
     def move_item(self, src_path: pathType, dst_path: pathType, **kwargs) -> None:
         flag = False
@@ -346,6 +838,8 @@ class Pan(driveInterface):
                 }
             )
         self.file_manager("move", filelist)
+        for src_path in src_path_list:
+            self.mirror_apply("move_item", src_path, dst_path)
 
     def copy_item(self, src_path: pathType, dst_path: pathType, **kwargs) -> None:
         flag = False
@@ -361,31 +855,32 @@ class Pan(driveInterface):
         except pathNotFoundError:
             if len(src_path_list) > 1:
                 raise pathNotFoundError(dst_path)
+        r_dst_path = self.get_relative_path(dst_path)
+        filelist = []
         for src_path in src_path_list:
             src_item = self.get_item(src_path)
             if src_item.type == 1 and not (
                 "recursive" in kwargs and kwargs["recursive"]
             ):
                 raise driveError(602, "Is a directory", data={"path": src_path})
-            r_dst_path = self.get_relative_path(dst_path)
-            filelist = []
-            for src_path in src_path_list:
-                r_src_path = self.get_relative_path(src_path)
-                filelist.append(
-                    {
-                        "path": "/" + str(r_src_path),
-                        "dest": "/" + str(r_dst_path if flag else r_dst_path.dirname),
-                        "newname": r_src_path.basename if flag else r_dst_path.basename,
-                    }
-                )
-            try:
+            r_src_path = self.get_relative_path(src_path)
+            filelist.append(
+                {
+                    "path": "/" + str(r_src_path),
+                    "dest": "/" + str(r_dst_path if flag else r_dst_path.dirname),
+                    "newname": r_src_path.basename if flag else r_dst_path.basename,
+                }
+            )
+        try:
+            self.file_manager("copy", filelist)
+        except driveError as e:
+            if e.code == 603 and "force" in kwargs and kwargs["force"]:
+                self.remove_item(dst_path)
                 self.file_manager("copy", filelist)
-            except driveError as e:
-                if e.code == 603 and "force" in kwargs and kwargs["force"]:
-                    self.remove_item(dst_path)
-                    self.file_manager("copy", filelist)
-                else:
-                    raise e
+            else:
+                raise e
+        for src_path in src_path_list:
+            self.mirror_apply("copy_item", src_path, dst_path, recursive=True)
 
     def remove_item(self, path: pathType, **kwargs) -> None:
         path_list = self.parse_wildcard(path)
@@ -403,6 +898,8 @@ class Pan(driveInterface):
             r_path = self.get_relative_path(path)
             filelist.append("/" + str(r_path))
         self.file_manager("delete", filelist)
+        for path in path_list:
+            self.mirror_apply("remove_item", path, recursive=True, force=True)
 
     def add_item(self, path: pathType, type: int, **kwargs) -> None:
         r_path = self.get_relative_path(path)
@@ -415,3 +912,65 @@ class Pan(driveInterface):
             self.rapid_upload("/" + str(r_path), data)
         else:
             self.create_dir("/" + str(r_path))
+        self.mirror_apply("add_item", path, type, **kwargs)
+
+    def bulk_add(self, links, **kwargs) -> dict:
+        # 并行秒传, report(link, path, error) 按输入顺序逐项报告结果
+        # 先由 create_dirs 一次性建好所有上级目录及 dirs 中的目录, 再开始秒传
+        base_path = kwargs["path"] if "path" in kwargs else self.base_path
+        policy = kwargs["policy"] if "policy" in kwargs else "skip"
+        report = kwargs["report"] if "report" in kwargs else None
+        dirs = kwargs["dirs"] if "dirs" in kwargs else []
+        if policy not in ("skip", "overwrite", "fail"):
+            raise ValueError("Unknown policy: {}".format(policy))
+        stat = {"added": 0, "skipped": 0, "overwritten": 0, "failed": 0}
+        added = []
+        links = list(self.iter_links(links))
+        # 有 report 时目录创建失败不中止, 其下的文件在秒传时逐项报告失败
+        self.create_dirs(
+            [(base_path + link.path).dirname for link in links] + list(dirs),
+            report=(lambda path, error: None) if report is not None else None,
+        )
+        jobs = (
+            (
+                (link, base_path + link.path),
+                "/" + str(self.get_relative_path(base_path + link.path)),
+                {"md5": link.md5, "md5_s": link.md5_s, "size": link.size},
+            )
+            for link in links
+        )
+        results = self.rapid_upload_many(jobs)
+        try:
+            for (link, path), error in results:
+                if error is not None and error.code == 603 and policy == "overwrite":
+                    self.remove_item(path)
+                    try:
+                        self.rapid_upload(
+                            "/" + str(self.get_relative_path(path)),
+                            {"md5": link.md5, "md5_s": link.md5_s, "size": link.size},
+                        )
+                        error = None
+                        stat["overwritten"] += 1
+                    except driveError as e:
+                        error = e
+                elif error is None:
+                    stat["added"] += 1
+                if error is None:
+                    added.append(linkType(link.md5, link.md5_s, link.size, path))
+                elif error.code == 603 and policy == "skip":
+                    stat["skipped"] += 1
+                elif report is None or error.code == 603:
+                    raise error
+                else:
+                    stat["failed"] += 1
+                if report is not None:
+                    report(link, path, error)
+        finally:
+            results.close()
+            if self.upload_cache is not None:
+                self.upload_cache.flush()
+            if added:
+                self.mirror_apply(
+                    "bulk_add", added, path=self.base_path, policy="overwrite"
+                )
+        return stat
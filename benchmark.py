@@ -0,0 +1,140 @@
+import time
+import argparse
+from helperType import pathType, linkType
+from baiduUtil import Pan
+from fakeBaidu import fakeBaidu
+
+# 针对进程内 fakeBaidu 测量 Pan 的吞吐: 服务端收到的请求数/秒, 总耗时,
+# 以及在客户端计时的单次调用耗时 p50/p99 (含限速等待、排队与限流重试)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def instrument(pan: Pan) -> list:
+    # 包装 Pan.request (或异步传输的 request), 返回记录每次调用耗时的列表
+    durations = []
+    if pan.transport is None:
+        request = pan.request
+
+        def timed(method: str, url: str, **kwargs) -> dict:
+            start = time.monotonic()
+            try:
+                return request(method, url, **kwargs)
+            finally:
+                durations.append(time.monotonic() - start)
+
+        pan.request = timed
+    else:
+        request = pan.transport.request
+
+        async def timed_async(method: str, url: str, **kwargs) -> dict:
+            start = time.monotonic()
+            try:
+                return await request(method, url, **kwargs)
+            finally:
+                durations.append(time.monotonic() - start)
+
+        pan.transport.request = timed_async
+    return durations
+
+
+def report(name: str, count: int, requests: int, durations: list, wall: float):
+    print(
+        "{:<12} {:>8} items  wall {:>8.2f}s  {:>7} req  {:>8.1f} req/s"
+        "  {:>7} calls  p50 {:>7.1f}ms  p99 {:>7.1f}ms".format(
+            name,
+            count,
+            wall,
+            requests,
+            requests / wall if wall > 0 else 0,
+            len(durations),
+            percentile(durations, 0.5) * 1000,
+            percentile(durations, 0.99) * 1000,
+        )
+    )
+
+
+def run(name: str, fake: fakeBaidu, durations: list, func) -> None:
+    fake.reset_stats()
+    durations.clear()
+    start = time.monotonic()
+    count = func()
+    wall = time.monotonic() - start
+    report(name, count, len(fake.requests), list(durations), wall)
+
+
+def bench_bulk_add(pan: Pan, args) -> int:
+    links = [
+        linkType(
+            "%032x" % i,
+            "%032x" % i,
+            i,
+            pathType(["add", "d{}".format(i % args.dirs), "f{}".format(i)], False),
+        )
+        for i in range(args.files)
+    ]
+    pan.bulk_add(links, path=pan.base_path, policy="fail")
+    return len(links)
+
+
+def bench_walk(pan: Pan, args) -> int:
+    return sum(1 for _ in pan.walk(pan.base_path + pathType(["add"], False)))
+
+
+def bench_move(pan: Pan, args) -> int:
+    pan.add_item(pan.base_path + pathType(["moved"], False), 1)
+    pan.move_item(
+        pan.base_path + pathType.path_from_str("flat/*", absolute=False),
+        pan.base_path + pathType(["moved"], False),
+    )
+    return args.files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Pan against fakeBaidu.")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--dirs", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--throttle", type=float, default=0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--upload-workers", type=int, default=16)
+    parser.add_argument("--rate-limit", type=float, default=100)
+    parser.add_argument(
+        "--transport", choices=["threads", "asyncio"], default="threads"
+    )
+    args = parser.parse_args()
+
+    fake = fakeBaidu(
+        latency=args.latency, page_size=args.page_size, throttle=args.throttle
+    )
+    fake.serve()
+    for i in range(args.files):
+        fake.add_file("/flat/f{}".format(i), "%032x" % i, i)
+    pan = Pan(
+        pathType.path_from_str("/bench"),
+        "",
+        workers=args.workers,
+        upload_workers=args.upload_workers,
+        rate_limit=args.rate_limit,
+        transport=args.transport,
+        cache_ttl=0,
+        api_base=fake.api_base,
+        share_base=fake.share_base,
+        page_size=args.page_size,
+    )
+    durations = instrument(pan)
+    pan.get_bdstoken()
+    run("bulk add", fake, durations, lambda: bench_bulk_add(pan, args))
+    run("walk", fake, durations, lambda: bench_walk(pan, args))
+    run("move", fake, durations, lambda: bench_move(pan, args))
+    fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
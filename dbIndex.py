@@ -0,0 +1,180 @@
+import re
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+# 与 ITEM_COLUMNS 同名的字段, 可直接交给 DB.item_to_itemType
+indexRow = namedtuple(
+    "indexRow",
+    ["id", "type", "name", "md5", "md5_s", "size", "total_size", "file_count"],
+)
+
+
+class treeIndex:
+    # 以列数组保存整棵树, 同一目录的子项按名称连续存放
+    # dirs: 目录 id -> (槽位, 子项起始, 子项结束), dirty: 子项已变化、需回落到 SQLite 的目录
+    def __init__(self, rows):
+        self.ids = array("q")
+        self.parents = array("q")
+        self.types = array("b")
+        self.sizes = array("q")
+        self.totals = array("q")
+        self.counts = array("q")
+        # 名称池中每个名称前后均为 \0, 便于直接用正则在整个池上搜索
+        self.name_offsets = array("Q", [1])
+        self.names = bytearray(b"\0")
+        # 十六进制 md5/md5_s 压缩为 16+16 字节, 其余放入 odd_hashes
+        self.hashes = bytearray()
+        self.odd_hashes = {}
+        self.dirs = {0: (-1, 0, 0)}
+        self.dirty = set()
+        dir_slots = {}
+        last_parent, start = None, 0
+        for id, parent_id, type, name, size, md5, md5_s, total, count in rows:
+            slot = len(self.ids)
+            if parent_id != last_parent:
+                if last_parent is not None:
+                    self.dirs[last_parent] = (-1, start, slot)
+                last_parent, start = parent_id, slot
+            self.ids.append(id)
+            self.parents.append(parent_id)
+            self.types.append(type)
+            self.sizes.append(int(size or 0))
+            self.totals.append(total or 0)
+            self.counts.append(count or 0)
+            self.names += name.encode("utf-8") + b"\0"
+            self.name_offsets.append(len(self.names))
+            try:
+                packed = bytes.fromhex(md5) + bytes.fromhex(md5_s)
+            except (TypeError, ValueError):
+                packed = None
+            if packed is not None and len(packed) == 32 and packed.hex() == md5 + md5_s:
+                self.hashes += packed
+            else:
+                self.hashes += bytes(32)
+                self.odd_hashes[slot] = (md5, md5_s)
+            if type == 1:
+                dir_slots[id] = slot
+        if last_parent is not None:
+            self.dirs[last_parent] = (-1, start, len(self.ids))
+        for id, slot in dir_slots.items():
+            _, start, end = self.dirs.get(id, (-1, 0, 0))
+            self.dirs[id] = (slot, start, end)
+        # 父目录已不在树中的子项 (孤立项) 不可达
+        for id in list(self.dirs):
+            if id != 0 and self.dirs[id][0] == -1:
+                del self.dirs[id]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def name(self, slot: int) -> str:
+        return self.names[
+            self.name_offsets[slot] : self.name_offsets[slot + 1] - 1
+        ].decode("utf-8")
+
+    def row(self, slot: int) -> indexRow:
+        if slot in self.odd_hashes:
+            md5, md5_s = self.odd_hashes[slot]
+        else:
+            md5 = self.hashes[32 * slot : 32 * slot + 16].hex()
+            md5_s = self.hashes[32 * slot + 16 : 32 * slot + 32].hex()
+        return indexRow(
+            self.ids[slot],
+            self.types[slot],
+            self.name(slot),
+            md5,
+            md5_s,
+            self.sizes[slot],
+            self.totals[slot],
+            self.counts[slot],
+        )
+
+    def is_clean(self, id: int) -> bool:
+        return id in self.dirs and id not in self.dirty
+
+    def child(self, parent_id: int, name: str):
+        # 在目录的子项区间内按 UTF-8 字节序二分查找, 与 SQLite 的 BINARY 排序一致
+        _, low, high = self.dirs[parent_id]
+        key = name.encode("utf-8")
+        offsets = self.name_offsets
+        while low < high:
+            mid = (low + high) // 2
+            if self.names[offsets[mid] : offsets[mid + 1] - 1] < key:
+                low = mid + 1
+            else:
+                high = mid
+        if (
+            low < self.dirs[parent_id][2]
+            and self.names[offsets[low] : offsets[low + 1] - 1] == key
+        ):
+            return low
+        return None
+
+    def resolve(self, key: tuple):
+        # 经由未变化的目录逐级解析路径, 返回槽位; 途经已变化的目录时返回 None, 不存在时抛出 KeyError
+        parent_id = 0
+        slot = None
+        for name in key:
+            if not self.is_clean(parent_id):
+                return None
+            slot = self.child(parent_id, name)
+            if slot is None:
+                raise KeyError(key)
+            parent_id = self.ids[slot]
+        return slot
+
+    def children(self, id: int):
+        # 目录在前, 与 SQL 查询的 ORDER BY type DESC 一致
+        _, start, end = self.dirs[id]
+        for slot in range(start, end):
+            if self.types[slot] == 1:
+                yield slot
+        for slot in range(start, end):
+            if self.types[slot] != 1:
+                yield slot
+
+    def walk(self, roots: list):
+        # 深度优先遍历, roots 为 [(目录 id, 名称元组)], 产出 (槽位, 父目录名称元组)
+        stack = list(roots)
+        while stack:
+            id, key = stack.pop()
+            _, start, end = self.dirs[id]
+            for slot in range(start, end):
+                yield slot, key
+                if self.types[slot] == 1 and self.ids[slot] in self.dirs:
+                    stack.append((self.ids[slot], key + (self.name(slot),)))
+
+    def match_name(self, slot: int, pattern: re.Pattern) -> bool:
+        return (
+            pattern.fullmatch(
+                self.names, self.name_offsets[slot], self.name_offsets[slot + 1] - 1
+            )
+            is not None
+        )
+
+    def search(self, pattern: re.Pattern):
+        # 在整个名称池上查找完整匹配某个名称的位置, 按槽位顺序产出
+        pattern = re.compile(
+            b"(?<=\0)(?:" + pattern.pattern + b")(?=\0)", pattern.flags
+        )
+        for m in pattern.finditer(self.names):
+            yield bisect_right(self.name_offsets, m.start()) - 1
+
+    def key(self, id: int) -> tuple:
+        # 由 parents 数组向上取得目录的名称元组; 途经非目录或孤立项时不可达, 返回 None
+        names = []
+        while id != 0:
+            if id not in self.dirs:
+                return None
+            slot = self.dirs[id][0]
+            names.append(self.name(slot))
+            id = self.parents[slot]
+        return tuple(reversed(names))
+
+    def add_totals(self, ids, size: int, count: int) -> None:
+        for id in ids:
+            if id in self.dirs and id != 0:
+                slot = self.dirs[id][0]
+                self.totals[slot] += size
+                self.counts[slot] += count
@@ -0,0 +1,188 @@
+import sqlalchemy
+from sqlalchemy import text
+
+
+# 每个迁移是 (版本号, 说明, 函数), 函数在同一事务中接收连接对象
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+
+    return decorator
+
+
+@migration(1, "unique (parent_id, name) index")
+def unique_parent_name(conn) -> None:
+    # 旧库中可能存在同名项, 重命名为 "name (id)" 后再建立唯一索引
+    rows = conn.execute(
+        text(
+            "SELECT id, name FROM items WHERE id NOT IN"
+            " (SELECT MIN(id) FROM items GROUP BY parent_id, name)"
+        )
+    ).all()
+    for row in rows:
+        conn.execute(
+            text("UPDATE items SET name = :name WHERE id = :id"),
+            {"id": row[0], "name": "{} ({})".format(row[1], row[0])},
+        )
+    conn.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_items_parent_id_name"
+            " ON items (parent_id, name)"
+        )
+    )
+
+
+@migration(2, "md5/size index")
+def md5_size(conn) -> None:
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_items_md5_size ON items (md5, size)")
+    )
+
+
+@migration(3, "id_path index")
+def id_path(conn) -> None:
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_items_id_path ON items (id_path)"))
+
+
+@migration(4, "root-anchored id_path")
+def root_anchored_id_path(conn) -> None:
+    # 按 parent_id 重建 id_path 为 "/祖先id/.../自身id", 无法到达根的孤立项置空
+    conn.execute(text("DROP TABLE IF EXISTS temp.new_id_path"))
+    conn.execute(
+        text("CREATE TEMP TABLE new_id_path (id INTEGER PRIMARY KEY, id_path VARCHAR)")
+    )
+    conn.execute(
+        text(
+            "INSERT INTO new_id_path (id, id_path)"
+            " WITH RECURSIVE tree(id, id_path) AS ("
+            " SELECT id, '/' || id FROM items WHERE parent_id = 0"
+            " UNION ALL"
+            " SELECT items.id, tree.id_path || '/' || items.id"
+            " FROM items JOIN tree ON items.parent_id = tree.id"
+            ") SELECT id, id_path FROM tree"
+        )
+    )
+    conn.execute(
+        text(
+            "UPDATE items SET id_path ="
+            " (SELECT id_path FROM new_id_path WHERE new_id_path.id = items.id)"
+        )
+    )
+    conn.execute(text("DROP TABLE new_id_path"))
+
+
+@migration(5, "directory total_size and file_count")
+def directory_totals(conn) -> None:
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(items)"))]
+    for column in ["total_size", "file_count"]:
+        if column not in columns:
+            conn.execute(
+                text("ALTER TABLE items ADD COLUMN {} INTEGER DEFAULT 0".format(column))
+            )
+    conn.execute(
+        text(
+            "UPDATE items SET total_size = COALESCE(size, 0), file_count = 1"
+            " WHERE type = 0"
+        )
+    )
+    conn.execute(
+        text(
+            "UPDATE items SET (total_size, file_count) ="
+            " (SELECT COALESCE(SUM(f.size), 0), COUNT(f.id) FROM items f"
+            " WHERE f.type = 0 AND f.id_path >= items.id_path || '/'"
+            " AND f.id_path < items.id_path || '0')"
+            " WHERE type = 1"
+        )
+    )
+
+
+def get_version(conn) -> int:
+    return conn.execute(
+        text("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    ).scalar()
+
+
+def migrate(engine: sqlalchemy.engine.Engine) -> int:
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_version"
+                " (version INTEGER PRIMARY KEY, description VARCHAR(256))"
+            )
+        )
+        version = get_version(conn)
+    applied = False
+    for m_version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if m_version <= version:
+            continue
+        with engine.begin() as conn:
+            func(conn)
+            conn.execute(
+                text(
+                    "INSERT INTO schema_version (version, description)"
+                    " VALUES (:version, :description)"
+                ),
+                {"version": m_version, "description": description},
+            )
+        version = m_version
+        applied = True
+    if applied:
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+    return version
+
+
+# 可选的 FTS5 (trigram) 名称索引, 由触发器与 items 表保持同步
+NAME_INDEX_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS items_name_fts_insert AFTER INSERT ON items BEGIN"
+    " INSERT INTO items_name_fts (rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS items_name_fts_delete AFTER DELETE ON items BEGIN"
+    " INSERT INTO items_name_fts (items_name_fts, rowid, name)"
+    " VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS items_name_fts_update AFTER UPDATE OF name ON items"
+    " BEGIN"
+    " INSERT INTO items_name_fts (items_name_fts, rowid, name)"
+    " VALUES ('delete', old.id, old.name);"
+    " INSERT INTO items_name_fts (rowid, name) VALUES (new.id, new.name); END",
+]
+
+
+def enable_name_index(engine: sqlalchemy.engine.Engine) -> bool:
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text(
+                    "SELECT COUNT(*) FROM sqlite_master"
+                    " WHERE type = 'table' AND name = 'items_name_fts'"
+                )
+            ).scalar()
+            if not exists:
+                conn.execute(
+                    text(
+                        "CREATE VIRTUAL TABLE items_name_fts USING fts5"
+                        "(name, content='items', content_rowid='id', tokenize='trigram')"
+                    )
+                )
+                conn.execute(
+                    text(
+                        "INSERT INTO items_name_fts (items_name_fts) VALUES ('rebuild')"
+                    )
+                )
+            for trigger in NAME_INDEX_TRIGGERS:
+                conn.execute(text(trigger))
+    except sqlalchemy.exc.OperationalError:
+        # SQLite 未编译 FTS5 或不支持 trigram 分词器
+        return False
+    return True
+
+
+def disable_name_index(engine: sqlalchemy.engine.Engine) -> None:
+    # 关闭时删除索引, 避免触发器缺失导致索引过期
+    with engine.begin() as conn:
+        for name in ["insert", "delete", "update"]:
+            conn.execute(text("DROP TRIGGER IF EXISTS items_name_fts_" + name))
+        conn.execute(text("DROP TABLE IF EXISTS items_name_fts"))
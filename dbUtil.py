@@ -1,13 +1,41 @@
+import re
+import inspect
+import threading
+from functools import wraps
 import sqlalchemy
-from sqlalchemy import Column, Integer, String, or_, func
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Column, Index, Integer, String, and_, or_, func, text
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
-from helperType import pathType, itemType
+from helperType import pathType, itemType, lruCache
 from driveInterface import *
+from dbMigration import migrate, enable_name_index, disable_name_index
+from snapshotUtil import CHUNK_SIZE, write_snapshot, read_snapshot
+from dbIndex import treeIndex
+
+
+def set_pragmas(dbapi_connection, connection_record) -> None:
+    # 由 SQLAlchemy 显式发出 BEGIN, 使同一工作单元内的读取看到同一快照
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def begin_transaction(connection) -> None:
+    connection.exec_driver_sql("BEGIN")
 
 
 class Items(declarative_base()):
     __tablename__ = "items"
+    __table_args__ = (
+        Index("ix_items_parent_id_name", "parent_id", "name", unique=True),
+        Index("ix_items_md5_size", "md5", "size"),
+        Index("ix_items_id_path", "id_path"),
+    )
     id = Column(Integer, primary_key=True)
     type = Column(Integer)
     name = Column(String(256))
@@ -16,25 +44,195 @@ class Items(declarative_base()):
     md5 = Column(String(32))
     md5_s = Column(String(32))
     size = Column(Integer)
+    # 文件为自身大小与 1, 目录为子树内所有文件的总大小与文件数
+    total_size = Column(Integer, default=0)
+    file_count = Column(Integer, default=0)
 
     def __init__(self, type, name, parent_id, id_path, size, md5, md5_s):
         self.md5 = md5
         self.md5_s = md5_s
         self.size = size
+        self.total_size = int(size or 0) if type == 0 else 0
+        self.file_count = 1 if type == 0 else 0
         self.type = type
         self.name = name
         self.parent_id = parent_id
         self.id_path = id_path
 
 
+# 只读结果集直接取列, 避免构造 ORM 对象
+ITEM_COLUMNS = (
+    Items.id,
+    Items.type,
+    Items.name,
+    Items.id_path,
+    Items.parent_id,
+    Items.md5,
+    Items.md5_s,
+    Items.size,
+    Items.total_size,
+    Items.file_count,
+)
+
+
+def unit(func):
+    # 一次调用为一个工作单元, 最外层结束时在并发模式下释放本线程的会话
+    if inspect.isgeneratorfunction(func):
+
+        @wraps(func)
+        def gen_wrapper(self, *args, **kwargs):
+            self.begin_unit()
+            try:
+                yield from func(self, *args, **kwargs)
+            finally:
+                self.end_unit()
+
+        return gen_wrapper
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        self.begin_unit()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.end_unit()
+
+    return wrapper
+
+
+def writer(func):
+    # 写操作由单一写锁串行化
+    func = unit(func)
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.write_lock:
+            self.local.writing = getattr(self.local, "writing", 0) + 1
+            try:
+                return func(self, *args, **kwargs)
+            except Exception as e:
+                # 写入失败回滚后, 内存索引可能已被修补, 整体重建
+                self.index = None
+                raise e
+            finally:
+                self.local.writing -= 1
+                if self.concurrent and getattr(self.local, "depth", 0) == 0:
+                    # 使其他线程在写入前开始的工作单元不再写入缓存
+                    self.generation += 1
+                    self.path_cache.clear()
+                    self.id_cache.clear()
+
+    return wrapper
+
+
 class DB(driveInterface):
-    def __init__(self, base_path: pathType, db_file: str):
+    path_cache: lruCache
+    id_cache: lruCache
+    name_index: bool
+    concurrent: bool
+    memory_index: bool
+
+    def __init__(
+        self,
+        base_path: pathType,
+        db_file: str,
+        cache_size: int = 65536,
+        name_index: bool = True,
+        concurrent: bool = False,
+        memory_index: bool = False,
+    ):
         self.base_path = base_path
         self.drive_type = "database"
-        self.sql = sqlalchemy.create_engine(f"sqlite:///{db_file}")
+        self.concurrent = concurrent
+        if concurrent:
+            self.sql = sqlalchemy.create_engine(
+                f"sqlite:///{db_file}", connect_args={"check_same_thread": False}
+            )
+            event.listen(self.sql, "connect", set_pragmas)
+            event.listen(self.sql, "begin", begin_transaction)
+        else:
+            self.sql = sqlalchemy.create_engine(f"sqlite:///{db_file}")
         self.sql.connect()
         Items.metadata.create_all(self.sql)
-        self.session = sessionmaker(self.sql)()
+        migrate(self.sql)
+        if name_index:
+            self.name_index = enable_name_index(self.sql)
+        else:
+            disable_name_index(self.sql)
+            self.name_index = False
+        if concurrent:
+            self.session = scoped_session(sessionmaker(self.sql))
+        else:
+            self.session = sessionmaker(self.sql)()
+        self.write_lock = threading.RLock()
+        self.local = threading.local()
+        self.generation = 0
+        # 路径缓存: 相对路径(tuple) -> id, id -> (祖先id链, 名称链)
+        self.path_cache = lruCache(int(cache_size))
+        self.id_cache = lruCache(int(cache_size))
+        # 可选的内存树索引, 为 None 时在下次读取时重建
+        self.memory_index = memory_index
+        self.index = None
+
+    def begin_unit(self) -> None:
+        depth = getattr(self.local, "depth", 0)
+        if depth == 0:
+            self.local.generation = self.generation
+        self.local.depth = depth + 1
+
+    def end_unit(self) -> None:
+        self.local.depth -= 1
+        if self.local.depth == 0 and self.concurrent:
+            self.session.remove()
+
+    def cache_put(self, cache: lruCache, key, value) -> None:
+        # 并发模式下, 工作单元开始后若有写入提交, 其读取结果可能已过期
+        if not self.concurrent or getattr(self.local, "generation", None) == (
+            self.generation
+        ):
+            cache.put(key, value)
+
+    def get_index(self, clean: bool = False):
+        # 写操作只标记变化的目录, 按目录的读取仍可使用其余部分;
+        # clean 为 True 时 (搜索需要整棵树) 有变化的目录则重建
+        if not self.memory_index:
+            return None
+
+        def stale() -> bool:
+            return self.index is None or (clean and bool(self.index.dirty))
+
+        if stale() and not getattr(self.local, "writing", 0):
+            with self.write_lock:
+                if stale():
+                    conn = self.sql.raw_connection()
+                    try:
+                        cursor = conn.cursor()
+                        cursor.execute(
+                            "SELECT id, parent_id, type, name, size, md5, md5_s,"
+                            " total_size, file_count FROM items"
+                            " WHERE id_path IS NOT NULL ORDER BY parent_id, name"
+                        )
+                        self.index = treeIndex(cursor)
+                        cursor.close()
+                    finally:
+                        conn.close()
+        return self.index
+
+    def index_touch(self, *ids) -> None:
+        # 子项发生变化的目录改由 SQLite 提供, 过多时整体重建
+        if self.index is not None:
+            self.index.dirty.update(ids)
+            if len(self.index.dirty) > 4096:
+                self.index = None
+
+    def index_slot(self, path: pathType):
+        index = self.get_index()
+        if index is None:
+            return None
+        try:
+            return index.resolve(tuple(self.get_relative_path(path).path))
+        except KeyError:
+            raise pathNotFoundError(path)
 
     def item_to_itemType(self, item: Items, **kwargs) -> itemType:
         data = {
@@ -42,6 +240,8 @@ class DB(driveInterface):
             "md5": item.md5,
             "md5_s": item.md5_s,
             "size": item.size,
+            "total_size": item.total_size,
+            "file_count": item.file_count,
             "drive_type": "database",
         }
         if "path" in kwargs:
@@ -51,92 +251,416 @@ class DB(driveInterface):
         res_item = itemType(path, item.type, data)
         return res_item
 
+    def items_to_itemTypes(self, items: list[Items], names: dict = None) -> list:
+        # 由 id_path 批量查询祖先名称, names 为结果集内共享的目录 id -> name 表
+        if names is None:
+            names = {}
+        for item in items:
+            if item.type == 1:
+                names[item.id] = item.name
+        missing = list(
+            {
+                int(i)
+                for item in items
+                if item.id_path
+                for i in item.id_path.strip("/").split("/")[:-1]
+            }
+            - names.keys()
+        )
+        for i in range(0, len(missing), 500):
+            names.update(
+                self.session.query(Items.id, Items.name)
+                .filter(Items.id.in_(missing[i : i + 500]))
+                .all()
+            )
+        res_list = []
+        for item in items:
+            if item.id_path:
+                path = pathType(
+                    [names[int(i)] for i in item.id_path.strip("/").split("/")[:-1]]
+                    + [item.name],
+                    False,
+                )
+                res_list.append(self.item_to_itemType(item, path=path))
+            else:
+                res_list.append(self.item_to_itemType(item))
+        return res_list
+
+    def get_chain(self, id: int) -> tuple:
+        # 一条递归查询取得从根到该项的 (id链, 名称链)
+        chain = self.id_cache.get(id)
+        if chain is not None:
+            return chain
+        rows = self.session.execute(
+            text(
+                "WITH RECURSIVE chain(id, parent_id, name, depth) AS ("
+                " SELECT id, parent_id, name, 0 FROM items WHERE id = :id"
+                " UNION ALL"
+                " SELECT items.id, items.parent_id, items.name, chain.depth + 1"
+                " FROM items JOIN chain ON items.id = chain.parent_id"
+                ") SELECT id, name FROM chain ORDER BY depth DESC"
+            ),
+            {"id": id},
+        ).all()
+        if not rows:
+            raise driveError(404, "Item Not Found.", data={"id": id})
+        chain = (tuple(row[0] for row in rows), tuple(row[1] for row in rows))
+        self.cache_put(self.id_cache, id, chain)
+        for i in range(len(chain[1])):
+            self.cache_put(self.path_cache, chain[1][: i + 1], chain[0][i])
+        return chain
+
     def id_to_path(self, id: int) -> pathType:
-        i = self.session.query(Items).filter_by(id=id).first()
-        path = pathType([i.name], False)
-        while i.parent_id != 0:
-            i = self.session.query(Items).filter_by(id=i.parent_id).first()
-            path = pathType([i.name], False) + path
-        return path
+        return pathType(list(self.get_chain(id)[1]), False)
 
     def path_to_id(self, path: pathType) -> int:
         r_path = self.get_relative_path(path)
-        id = 0
-        for p in r_path:
-            item = self.session.query(Items).filter_by(parent_id=id, name=p).first()
-            if item:
-                id = item.id
-            else:
-                raise pathNotFoundError(path)
-        return id
+        key = tuple(r_path.path)
+        if not key:
+            return 0
+        slot = self.index_slot(path)
+        if slot is not None:
+            return self.index.ids[slot]
+        id = self.path_cache.get(key)
+        if id is not None:
+            return id
+        # 从已缓存的最长前缀开始, 用一条递归查询解析剩余部分
+        start, depth = 0, 0
+        for i in range(len(key) - 1, 0, -1):
+            cached = self.path_cache.get(key[:i])
+            if cached is not None:
+                start, depth = cached, i
+                break
+        parts = key[depth:]
+        params = {"start": start}
+        values = []
+        for i, name in enumerate(parts):
+            params["n{}".format(i)] = name
+            values.append("({}, :n{})".format(i + 1, i))
+        rows = self.session.execute(
+            text(
+                "WITH RECURSIVE parts(depth, name) AS (VALUES {}),"
+                " walk(depth, id) AS ("
+                " SELECT 0, :start"
+                " UNION ALL"
+                " SELECT walk.depth + 1, items.id FROM walk"
+                " JOIN parts ON parts.depth = walk.depth + 1"
+                " JOIN items ON items.parent_id = walk.id AND items.name = parts.name"
+                ") SELECT depth, MIN(id) FROM walk WHERE depth > 0"
+                " GROUP BY depth ORDER BY depth".format(", ".join(values))
+            ),
+            params,
+        ).all()
+        if len(rows) < len(parts):
+            raise pathNotFoundError(path)
+        for row in rows:
+            self.cache_put(self.path_cache, key[: depth + row[0]], row[1])
+        return rows[-1][1]
 
     def get_id_path(self, id: int) -> str:
         if id == 0:
             return "/"
-        i = self.session.query(Items).filter_by(id=id).first()
-        id_path = "/" + str(i.id)
-        while i.parent_id != 0:
-            i = self.session.query(Items).filter_by(id=i.parent_id).first()
-            id_path = "/" + str(i.id) + id_path
-        return id_path
+        return "/" + "/".join(str(i) for i in self.get_chain(id)[0])
+
+    def update_totals(self, parent_id: int, size: int, count: int) -> None:
+        # 将子树大小/文件数的变化累加到 parent_id 及其所有祖先目录
+        if parent_id == 0 or (not size and not count):
+            return
+        chain = self.get_chain(parent_id)[0]
+        if self.index is not None:
+            self.index.add_totals(chain, size, count)
+        self.session.query(Items).filter(Items.id.in_(chain)).update(
+            {
+                Items.total_size: Items.total_size + size,
+                Items.file_count: Items.file_count + count,
+            },
+            synchronize_session=False,
+        )
+
+    def get_subtree_range(self, id: int) -> tuple:
+        # id_path 以根为起点, 子树即 "<id_path>/" 开头的前缀区间, 可走索引范围扫描
+        prefix = self.get_id_path(id).rstrip("/") + "/"
+        return prefix, prefix[:-1] + "0"
+
+    def subtree_filter(self, id: int):
+        low, high = self.get_subtree_range(id)
+        return and_(Items.id_path >= low, Items.id_path < high)
 
     # 实现driveInterface接口方法
 
     def list_dir(self, path: pathType) -> list[itemType]:
-        res_items = []
+        return list(self.iter_dir(path))
+
+    @unit
+    def iter_dir(self, path: pathType):
         id = self.path_to_id(path)
+        index = self.get_index()
+        if index is not None and index.is_clean(id):
+            for slot in index.children(id):
+                yield self.item_to_itemType(
+                    index.row(slot), path=(path + pathType([index.name(slot)], False))
+                )
+            return
         items = (
             self.session.query(Items)
             .filter_by(parent_id=id)
             .order_by(Items.type.desc())
-            .all()
+            .yield_per(1000)
         )
         for item in items:
-            res_items.append(
-                self.item_to_itemType(item, path=(path + pathType([item.name], False)))
+            yield self.item_to_itemType(
+                item, path=(path + pathType([item.name], False))
             )
-        return res_items
 
+    @unit
     def get_item(self, path: pathType) -> itemType:
-        id = self.path_to_id(path)
-        if id == 0:
+        if not self.get_relative_path(path).path:
             return itemType(self.base_path, 1, data={})
+        slot = self.index_slot(path)
+        if slot is not None:
+            return self.item_to_itemType(self.index.row(slot), path=path)
+        id = self.path_to_id(path)
         item = self.session.query(Items).filter_by(id=id).first()
         res_item = self.item_to_itemType(item, path=path)
         return res_item
 
     def search_items(self, **kwargs) -> list[itemType]:
-        query = self.session.query(Items)
-        path_filter = []
+        return list(self.iter_search_items(**kwargs))
+
+    @unit
+    def walk(self, path, max_depth: int = None, include: list = None, exclude=None):
+        # 不限深度且无排除条件时整棵子树由一次查询取得, 其余情况逐级列出
+        if max_depth is not None or exclude:
+            yield from driveInterface.walk(self, path, max_depth, include, exclude)
+            return
+        roots = []
+        for root in path if type(path) == list else [path]:
+            try:
+                self.path_to_id(root)
+            except pathNotFoundError:
+                continue
+            roots.append(root)
+        if not roots:
+            return
+        for item in self.iter_search_items(path=roots):
+            if not include or match_name(item.name, include):
+                yield item
+
+    @unit
+    def iter_search_items(self, **kwargs):
+        index = self.get_index(clean=True)
+        if index is not None and not index.dirty:
+            yield from self.index_search(index, **kwargs)
+            return
+        names = {}
+        items = []
+        for item in self.search_query(**kwargs).yield_per(1000):
+            items.append(item)
+            if len(items) >= 1000:
+                yield from self.items_to_itemTypes(items, names)
+                items = []
+        yield from self.items_to_itemTypes(items, names)
+
+    def index_search(self, index: treeIndex, **kwargs):
+        # 与 search_query 条件一致: LIKE 通配符, 仅 ASCII 字母忽略大小写
+        # 名称直接在 UTF-8 名称池上匹配, 只为命中项构造路径
+        pattern = None
+        if "name" in kwargs:
+            pattern = re.compile(
+                b"".join(
+                    b"[^\\0]*"
+                    if c in "*%"
+                    else b"(?:[\\x01-\\x7f]|[\\xc0-\\xff][\\x80-\\xbf]*)"
+                    if c in "?_"
+                    else re.escape(c.encode("utf-8"))
+                    for c in kwargs["name"]
+                ),
+                re.IGNORECASE,
+            )
         if "path" in kwargs and kwargs["path"]:
-            if type(kwargs["path"]) == type([]):
-                for path in kwargs["path"]:
-                    path_filter.append(
-                        Items.id_path.like("%/{}/%".format(str(self.path_to_id(path))))
-                    )
-            else:
-                path_filter.append(
-                    Items.id_path.like(
-                        "%/{}/%".format(str(self.path_to_id((kwargs["path"]))))
+            paths = kwargs["path"]
+            if type(paths) != type([]):
+                paths = [paths]
+            roots = []
+            for path in paths:
+                id = self.path_to_id(path)
+                if id in index.dirs:
+                    roots.append((id, tuple(self.get_relative_path(path).path)))
+            slots = (
+                (slot, key)
+                for slot, key in index.walk(roots)
+                if pattern is None or index.match_name(slot, pattern)
+            )
+        elif pattern is not None:
+            slots = ((slot, None) for slot in index.search(pattern))
+        else:
+            slots = ((slot, None) for slot in range(len(index)))
+        item_type = kwargs["type"] if "type" in kwargs else None
+        max_size = kwargs["max_size"] if "max_size" in kwargs else None
+        min_size = kwargs["min_size"] if "min_size" in kwargs else None
+        keys = {}
+        for slot, key in slots:
+            if item_type is not None and index.types[slot] != item_type:
+                continue
+            if max_size is not None and index.sizes[slot] > max_size:
+                continue
+            if min_size is not None and index.sizes[slot] < min_size:
+                continue
+            if key is None:
+                parent_id = index.parents[slot]
+                if parent_id not in keys:
+                    keys[parent_id] = index.key(parent_id)
+                key = keys[parent_id]
+                if key is None:
+                    continue
+            row = index.row(slot)
+            yield self.item_to_itemType(
+                row, path=pathType(list(key) + [row.name], False)
+            )
+
+    def paths_filter(self, paths):
+        if type(paths) != type([]):
+            paths = [paths]
+        return or_(*[self.subtree_filter(self.path_to_id(path)) for path in paths])
+
+    def search_query(self, **kwargs):
+        query = self.session.query(*ITEM_COLUMNS)
+        if "path" in kwargs and kwargs["path"]:
+            query = query.filter(self.paths_filter(kwargs["path"]))
+        if "name" in kwargs:
+            pattern = kwargs["name"].replace("*", "%").replace("?", "_")
+            # trigram 索引仅在含有至少3个连续普通字符时有效, 结果仍由 LIKE 精确过滤
+            if (
+                self.name_index
+                and max(len(p) for p in pattern.replace("_", "%").split("%")) >= 3
+            ):
+                query = query.filter(
+                    Items.id.in_(
+                        text(
+                            "SELECT rowid FROM items_name_fts WHERE name LIKE :pattern"
+                        )
+                        .bindparams(pattern=pattern)
+                        .columns(rowid=Integer)
                     )
                 )
-            query = query.filter(or_(*path_filter))
-        if "name" in kwargs:
-            query = query.filter(
-                Items.name.like(kwargs["name"].replace("*", "%").replace("?", "_"))
-            )
+            query = query.filter(Items.name.like(pattern))
         if "type" in kwargs:
             query = query.filter_by(type=kwargs["type"])
         if "max_size" in kwargs:
             query = query.filter(Items.size <= kwargs["max_size"])
         if "min_size" in kwargs:
             query = query.filter(Items.size >= kwargs["min_size"])
-        items = query.all()
-        res_list = []
-        for item in items:
-            res_list.append(self.item_to_itemType(item))
-        return res_list
+        return query
+
+    @unit
+    def disk_usage(self, path: pathType, depth: int = 0):
+        # 直接读取维护好的目录大小, 逐层查询子目录
+        id = self.path_to_id(path)
+        if id == 0:
+            row = (
+                self.session.query(
+                    func.coalesce(func.sum(Items.total_size), 0),
+                    func.coalesce(func.sum(Items.file_count), 0),
+                )
+                .filter_by(parent_id=0)
+                .first()
+            )
+            yield path, row[0], row[1]
+        else:
+            item = self.session.query(Items).filter_by(id=id).first()
+            yield path, item.total_size, item.file_count
+            if item.type == 0:
+                return
+        level = {id: path}
+        for i in range(depth):
+            next_level = {}
+            ids = list(level.keys())
+            for j in range(0, len(ids), 500):
+                rows = (
+                    self.session.query(*ITEM_COLUMNS)
+                    .filter(Items.parent_id.in_(ids[j : j + 500]), Items.type == 1)
+                    .order_by(Items.parent_id, Items.name)
+                )
+                for row in rows:
+                    sub_path = level[row.parent_id] + pathType([row.name], False)
+                    next_level[row.id] = sub_path
+                    yield sub_path, row.total_size, row.file_count
+            level = next_level
+
+    def duplicates_query(self, *entities, **kwargs):
+        # 按 (md5, size) 聚合, 可走 ix_items_md5_size 索引; keep 为每组 id 最小的项
+        groups = self.session.query(
+            Items.md5, Items.size, func.min(Items.id).label("keep")
+        ).filter(Items.type == 0, Items.md5 != "")
+        if "path" in kwargs and kwargs["path"]:
+            groups = groups.filter(self.paths_filter(kwargs["path"]))
+        groups = (
+            groups.group_by(Items.md5, Items.size)
+            .having(func.count(Items.id) > 1)
+            .subquery()
+        )
+        query = (
+            self.session.query(*entities)
+            .select_from(Items)
+            .join(groups, and_(Items.md5 == groups.c.md5, Items.size == groups.c.size))
+            .filter(Items.type == 0)
+        )
+        if "path" in kwargs and kwargs["path"]:
+            query = query.filter(self.paths_filter(kwargs["path"]))
+        if "keep" in kwargs and not kwargs["keep"]:
+            query = query.filter(Items.id != groups.c.keep)
+        return query
+
+    @unit
+    def find_duplicates(self, **kwargs):
+        names = {}
+        group = []
+        query = self.duplicates_query(*ITEM_COLUMNS, **kwargs).order_by(
+            Items.md5, Items.size, Items.id
+        )
+        for item in query.yield_per(1000):
+            if group and (group[-1].md5, group[-1].size) != (item.md5, item.size):
+                yield self.items_to_itemTypes(group, names)
+                group = []
+            group.append(item)
+        if group:
+            yield self.items_to_itemTypes(group, names)
+
+    @writer
+    def remove_duplicates(self, **kwargs) -> int:
+        # 每组保留 id 最小的一项, 删除其余项
+        totals = {}
+        for row in self.duplicates_query(
+            Items.id_path, Items.total_size, keep=False, **kwargs
+        ).yield_per(1000):
+            for i in row.id_path.strip("/").split("/")[:-1]:
+                total = totals.setdefault(int(i), [0, 0])
+                total[0] += row.total_size
+                total[1] += 1
+        if totals:
+            self.session.execute(
+                text(
+                    "UPDATE items SET total_size = total_size - :size,"
+                    " file_count = file_count - :count WHERE id = :id"
+                ),
+                [
+                    {"id": id, "size": total[0], "count": total[1]}
+                    for id, total in totals.items()
+                ],
+            )
+        ids = self.duplicates_query(Items.id, keep=False, **kwargs).subquery()
+        count = (
+            self.session.query(Items)
+            .filter(Items.id.in_(self.session.query(ids.c.id)))
+            .delete(synchronize_session=False)
+        )
+        self.session.commit()
+        self.path_cache.clear()
+        self.id_cache.clear()
+        self.index = None
+        return count
 
+    @writer
     def move_item(self, src_path: pathType, dst_path: pathType, **kwargs) -> None:
         flag = False
         src_path_list = self.parse_wildcard(src_path)
@@ -153,36 +677,72 @@ class DB(driveInterface):
         except pathNotFoundError:
             if len(src_path_list) > 1:
                 raise pathNotFoundError(dst_path)
-        for src_path in src_path_list:
-            src_id = self.path_to_id(src_path)
-            src_item = self.session.query(Items).filter_by(id=src_id).first()
-            parent_id = self.path_to_id(dst_path if flag else dst_path.dirname)
-            self.session.query(Items).filter_by(id=src_id).update(
-                {
-                    Items.parent_id: parent_id,
-                    Items.name: src_path.basename if flag else dst_path.basename,
-                    Items.id_path: func.replace(
-                        Items.id_path,
-                        "/{}/".format(src_item.parent_id),
-                        "/{}/".format(parent_id),
-                    ),
-                }
-            )
-            if src_item.type == 1:
+        try:
+            # 先检查全部冲突, 再开始修改
+            moves = []
+            for src_path in src_path_list:
+                src_id = self.path_to_id(src_path)
+                parent_id = self.dir_to_id(dst_path if flag else dst_path.dirname)
+                name = src_path.basename if flag else dst_path.basename
+                # 缓存在整个操作结束后才清除, id_path 以数据库中的为准
+                src_item = self.session.query(Items).filter_by(id=src_id).first()
+                parent_id_path = self.get_id_path(parent_id)
+                if (parent_id_path + "/").startswith(src_item.id_path + "/"):
+                    raise driveError(
+                        606,
+                        "Cannot move a directory into itself",
+                        data={"path": src_path},
+                    )
+                existing = (
+                    self.session.query(Items.id)
+                    .filter_by(parent_id=parent_id, name=name)
+                    .scalar()
+                )
+                if existing is not None and existing != src_id:
+                    raise driveError(
+                        603,
+                        "Path already exists",
+                        data={
+                            "path": (dst_path if flag else dst_path.dirname)
+                            + pathType([name], False)
+                        },
+                    )
+                moves.append((src_item, parent_id, parent_id_path, name))
+            for src_item, parent_id, parent_id_path, name in moves:
+                old_id_path = src_item.id_path
+                new_id_path = parent_id_path.rstrip("/") + "/" + str(src_item.id)
+                self.update_totals(
+                    src_item.parent_id, -src_item.total_size, -src_item.file_count
+                )
+                self.update_totals(parent_id, src_item.total_size, src_item.file_count)
+                self.index_touch(src_item.parent_id, parent_id)
                 self.session.query(Items).filter(
-                    Items.id_path.like("%/{}/%".format(src_id))
+                    self.subtree_filter(src_item.id)
                 ).update(
                     {
-                        Items.id_path: func.replace(
-                            Items.id_path,
-                            "/{}/".format(src_item.parent_id),
-                            "/{}/".format(parent_id),
-                        )
+                        Items.id_path: new_id_path
+                        + func.substr(Items.id_path, len(old_id_path) + 1)
                     },
-                    synchronize_session="fetch",
+                    synchronize_session=False,
                 )
-        self.session.commit()
+                self.session.query(Items).filter_by(id=src_item.id).update(
+                    {
+                        Items.parent_id: parent_id,
+                        Items.name: name,
+                        Items.id_path: new_id_path,
+                    },
+                    synchronize_session=False,
+                )
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            raise e
+        finally:
+            # 整个操作结束后一次性清除路径缓存, 不逐项扫描
+            self.path_cache.clear()
+            self.id_cache.clear()
 
+    @writer
     def copy_item(self, src_path: pathType, dst_path: pathType, **kwargs) -> None:
         flag = False
         src_path_list = self.parse_wildcard(src_path)
@@ -197,82 +757,554 @@ class DB(driveInterface):
         except pathNotFoundError:
             if len(src_path_list) > 1:
                 raise pathNotFoundError(dst_path)
-        for src_path in src_path_list:
-            src_id = self.path_to_id(src_path)
-            src_item = self.session.query(Items).filter_by(id=src_id).first()
-            if src_item.type == 1 and not (
-                "recursive" in kwargs and kwargs["recursive"]
+        force = kwargs["force"] if "force" in kwargs else False
+        try:
+            for src_path in src_path_list:
+                src_id = self.path_to_id(src_path)
+                src_item = self.session.query(Items).filter_by(id=src_id).first()
+                if src_item.type == 1 and not (
+                    "recursive" in kwargs and kwargs["recursive"]
+                ):
+                    raise driveError(602, "Is a directory", data={"path": src_path})
+                self.copy_tree(
+                    src_item,
+                    dst_path + pathType([src_item.name], False) if flag else dst_path,
+                    force,
+                )
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            self.path_cache.clear()
+            self.id_cache.clear()
+            raise e
+
+    def copy_tree(self, src_item: Items, dst_path: pathType, force: bool) -> None:
+        # 目标不存在时整棵子树批量复制, 仅在冲突处按 force 逐项合并
+        try:
+            dst_id = self.path_to_id(dst_path)
+        except pathNotFoundError:
+            self.copy_subtree(
+                src_item.id, self.make_dirs(dst_path.dirname), dst_path.basename
+            )
+            return
+        dst_item = self.session.query(Items).filter_by(id=dst_id).first()
+        if dst_item.type != src_item.type or not force:
+            raise driveError(603, "Path already exists", data={"path": dst_path})
+        if src_item.type == 0:
+            # 先累加差值: update 会同步会话中的 dst_item
+            self.update_totals(
+                dst_item.parent_id, src_item.total_size - dst_item.total_size, 0
+            )
+            self.index_touch(dst_item.parent_id)
+            self.session.query(Items).filter_by(id=dst_id).update(
+                {
+                    Items.size: src_item.size,
+                    Items.total_size: src_item.total_size,
+                    Items.md5: src_item.md5,
+                    Items.md5_s: src_item.md5_s,
+                }
+            )
+        else:
+            for item in (
+                self.session.query(Items).filter_by(parent_id=src_item.id).all()
             ):
-                raise driveError(602, "Is a directory", data={"path": src_path})
-            self.add_item(
-                path=dst_path + pathType([src_item.name], False) if flag else dst_path,
-                type=src_item.type,
-                size=src_item.size,
-                md5=src_item.md5,
-                md5_s=src_item.md5_s,
-                force=kwargs["force"] if "force" in kwargs else False,
+                self.copy_tree(item, dst_path + pathType([item.name], False), force)
+
+    def copy_subtree(self, src_id: int, parent_id: int, name: str) -> int:
+        # 以 INSERT ... SELECT 复制整棵子树, 重新分配 id 与 id_path (不提交)
+        low, high = self.get_subtree_range(src_id)
+        base = self.session.execute(
+            text("SELECT COALESCE(MAX(id), 0) FROM items")
+        ).scalar()
+        self.session.execute(text("DROP TABLE IF EXISTS temp.copy_map"))
+        self.session.execute(text("DROP TABLE IF EXISTS temp.copy_path"))
+        self.session.execute(
+            text(
+                "CREATE TEMP TABLE copy_map (old_id INTEGER PRIMARY KEY, new_id INTEGER)"
             )
-            if src_item.type == 1:
-                items = self.list_dir(src_path)
-                for item in items:
-                    self.copy_item(
-                        src_path + pathType([item.name], False),
-                        dst_path + pathType([item.name], False),
-                        **kwargs,
-                    )
+        )
+        self.session.execute(
+            text(
+                "INSERT INTO copy_map (old_id, new_id)"
+                " SELECT id, :base + ROW_NUMBER() OVER (ORDER BY id) FROM items"
+                " WHERE id = :src OR (id_path >= :low AND id_path < :high)"
+            ),
+            {"base": base, "src": src_id, "low": low, "high": high},
+        )
+        self.session.execute(
+            text(
+                "INSERT INTO items (id, type, name, id_path, parent_id, md5, md5_s,"
+                " size, total_size, file_count)"
+                " SELECT m.new_id, i.type,"
+                " CASE WHEN i.id = :src THEN :name ELSE i.name END, NULL,"
+                " COALESCE(p.new_id, :parent_id), i.md5, i.md5_s, i.size,"
+                " i.total_size, i.file_count"
+                " FROM copy_map m JOIN items i ON i.id = m.old_id"
+                " LEFT JOIN copy_map p ON p.old_id = i.parent_id AND i.id != :src"
+                " ORDER BY m.new_id"
+            ),
+            {"src": src_id, "name": name, "parent_id": parent_id},
+        )
+        root_id = self.session.execute(
+            text("SELECT new_id FROM copy_map WHERE old_id = :src"), {"src": src_id}
+        ).scalar()
+        self.session.execute(
+            text(
+                "CREATE TEMP TABLE copy_path (id INTEGER PRIMARY KEY, id_path VARCHAR)"
+            )
+        )
+        self.session.execute(
+            text(
+                "INSERT INTO copy_path (id, id_path)"
+                " WITH RECURSIVE tree(id, id_path) AS ("
+                " SELECT :root, :root_path"
+                " UNION ALL"
+                " SELECT items.id, tree.id_path || '/' || items.id"
+                " FROM items JOIN tree ON items.parent_id = tree.id"
+                ") SELECT id, id_path FROM tree"
+            ),
+            {
+                "root": root_id,
+                "root_path": self.get_id_path(parent_id).rstrip("/")
+                + "/"
+                + str(root_id),
+            },
+        )
+        self.session.execute(
+            text(
+                "UPDATE items SET id_path ="
+                " (SELECT id_path FROM copy_path WHERE copy_path.id = items.id)"
+                " WHERE id > :base"
+            ),
+            {"base": base},
+        )
+        self.session.execute(text("DROP TABLE copy_map"))
+        self.session.execute(text("DROP TABLE copy_path"))
+        root = (
+            self.session.query(Items.total_size, Items.file_count)
+            .filter_by(id=root_id)
+            .first()
+        )
+        self.update_totals(parent_id, root.total_size, root.file_count)
+        self.index_touch(parent_id)
+        return root_id
 
+    @writer
     def remove_item(self, path: pathType, **kwargs) -> None:
         path_list = self.parse_wildcard(path)
         if len(path_list) == 0 and not ("force" in kwargs and kwargs["force"]):
             raise pathNotFoundError(path)
-        for path in path_list:
-            id = self.path_to_id(path)
-            item = self.session.query(Items).filter_by(id=id).first()
-            if item.type == 1:
-                if "recursive" in kwargs and kwargs["recursive"]:
-                    self.session.query(Items).filter(
-                        Items.id_path.like("%/{}/%".format(id))
-                    ).delete(synchronize_session="fetch")
-                else:
+        try:
+            for path in path_list:
+                id = self.path_to_id(path)
+                item = self.session.query(Items).filter_by(id=id).first()
+                if item is None:
+                    # 已随前面删除的上级目录一并删除
+                    continue
+                if item.type == 1 and not (
+                    "recursive" in kwargs and kwargs["recursive"]
+                ):
                     raise driveError(602, "Is a directory", data={"path": path})
-            self.session.query(Items).filter_by(id=id).delete()
-        self.session.commit()
+                self.update_totals(item.parent_id, -item.total_size, -item.file_count)
+                self.index_touch(item.parent_id)
+                if item.type == 1:
+                    self.session.query(Items).filter(self.subtree_filter(id)).delete(
+                        synchronize_session=False
+                    )
+                self.session.query(Items).filter_by(id=id).delete()
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            raise e
+        finally:
+            self.path_cache.clear()
+            self.id_cache.clear()
 
+    @writer
     def add_item(self, path: pathType, type: int, **kwargs) -> None:
         try:
             id = self.path_to_id(path)
             item = self.session.query(Items).filter_by(id=id).first()
             if item.type == type and "force" in kwargs and kwargs["force"]:
+                size = kwargs["size"] if "size" in kwargs else 0
+                if type == 0:
+                    self.update_totals(
+                        item.parent_id, int(size or 0) - item.total_size, 0
+                    )
+                self.index_touch(item.parent_id)
                 item = (
                     self.session.query(Items)
                     .filter_by(id=id)
                     .update(
                         {
                             Items.type: type,
-                            Items.size: kwargs["size"] if "size" in kwargs else 0,
+                            Items.size: size,
+                            Items.total_size: int(size or 0)
+                            if type == 0
+                            else item.total_size,
                             Items.md5: kwargs["md5"] if "md5" in kwargs else "",
                             Items.md5_s: kwargs["md5_s"] if "md5_s" in kwargs else "",
                         }
                     )
                 )
+                self.session.commit()
             else:
                 raise driveError(603, "Path already exists", data={"path": path})
         except pathNotFoundError:
-            try:
-                parent_id = self.path_to_id(path.dirname)
-            except pathNotFoundError:
-                self.add_item(path.dirname, 1)
-                parent_id = self.path_to_id(path.dirname)
-            item = Items(
-                type=type,
-                name=path.basename,
-                parent_id=parent_id,
+            id = self.insert_item(
+                self.make_dirs(path.dirname),
+                path.basename,
+                type,
                 size=kwargs["size"] if "size" in kwargs else 0,
                 md5=kwargs["md5"] if "md5" in kwargs else "",
                 md5_s=kwargs["md5_s"] if "md5_s" in kwargs else "",
-                id_path="",
             )
-            parent_id_path = self.get_id_path(parent_id)
-            item.id_path = parent_id_path.rstrip("/") + "/" + str(item.id)
-            self.session.add(item)
             self.session.commit()
+            self.cache_put(
+                self.path_cache, tuple(self.get_relative_path(path).path), id
+            )
+
+    def dir_to_id(self, path: pathType) -> int:
+        # 同 path_to_id, 但路径必须是目录
+        id = self.path_to_id(path)
+        if id != 0 and self.session.query(Items.type).filter_by(id=id).scalar() != 1:
+            raise driveError(604, "Not a directory", data={"path": path})
+        return id
+
+    def make_dirs(self, path: pathType) -> int:
+        # 逐级创建缺失的目录 (不提交), 返回目录 id; 某一级是文件时抛出 604
+        try:
+            return self.dir_to_id(path)
+        except pathNotFoundError:
+            return self.insert_item(self.make_dirs(path.dirname), path.basename, 1)
+
+    def insert_item(self, parent_id: int, name: str, type: int, **kwargs) -> int:
+        item = Items(
+            type=type,
+            name=name,
+            parent_id=parent_id,
+            size=kwargs["size"] if "size" in kwargs else 0,
+            md5=kwargs["md5"] if "md5" in kwargs else "",
+            md5_s=kwargs["md5_s"] if "md5_s" in kwargs else "",
+            id_path="",
+        )
+        self.session.add(item)
+        self.session.flush()
+        item.id_path = self.get_id_path(parent_id).rstrip("/") + "/" + str(item.id)
+        self.session.flush()
+        self.update_totals(parent_id, item.total_size, item.file_count)
+        self.index_touch(parent_id)
+        return item.id
+
+    @writer
+    def bulk_add(self, links, **kwargs) -> dict:
+        base_path = kwargs["path"] if "path" in kwargs else self.base_path
+        policy = kwargs["policy"] if "policy" in kwargs else "skip"
+        batch_size = kwargs["batch_size"] if "batch_size" in kwargs else 10000
+        commit_size = kwargs["commit_size"] if "commit_size" in kwargs else 200000
+        dirs_to_add = kwargs["dirs"] if "dirs" in kwargs else []
+        if policy not in ("skip", "overwrite", "fail"):
+            raise ValueError("Unknown policy: {}".format(policy))
+        stat = {"added": 0, "skipped": 0, "overwritten": 0}
+        # 内存中的父目录表: 相对路径 -> (id, id_path), 目录id -> {name: (id, type, size)}
+        dirs = {(): (0, "/")}
+        children = {}
+        inserts = []
+        updates = []
+        # 祖先目录 id -> [大小变化, 文件数变化], 随批次一并写入
+        totals = {}
+        next_id = (
+            self.session.execute(
+                text("SELECT COALESCE(MAX(id), 0) FROM items")
+            ).scalar()
+            + 1
+        )
+        uncommitted = 0
+
+        def get_children(id: int) -> dict:
+            if id not in children:
+                rows = self.session.execute(
+                    text(
+                        "SELECT id, name, type, total_size FROM items"
+                        " WHERE parent_id = :id"
+                    ),
+                    {"id": id},
+                )
+                children[id] = {row[1]: (row[0], row[2], row[3]) for row in rows}
+            return children[id]
+
+        def add_totals(id_path: str, size: int, count: int):
+            for i in id_path.strip("/").split("/"):
+                if i:
+                    total = totals.setdefault(int(i), [0, 0])
+                    total[0] += size
+                    total[1] += count
+
+        def get_dir(key: tuple) -> tuple:
+            nonlocal next_id
+            if key in dirs:
+                return dirs[key]
+            parent_id, parent_id_path = get_dir(key[:-1])
+            entry = get_children(parent_id).get(key[-1])
+            if entry is None:
+                id = next_id
+                next_id += 1
+                inserts.append(
+                    {
+                        "id": id,
+                        "type": 1,
+                        "name": key[-1],
+                        "id_path": parent_id_path.rstrip("/") + "/" + str(id),
+                        "parent_id": parent_id,
+                        "md5": "",
+                        "md5_s": "",
+                        "size": 0,
+                        "total_size": 0,
+                        "file_count": 0,
+                    }
+                )
+                children[parent_id][key[-1]] = (id, 1, 0)
+                children[id] = {}
+            elif entry[1] != 1:
+                raise driveError(
+                    604,
+                    "Not a directory",
+                    data={"path": self.base_path + pathType(list(key), False)},
+                )
+            else:
+                id = entry[0]
+            dirs[key] = (id, parent_id_path.rstrip("/") + "/" + str(id))
+            return dirs[key]
+
+        def flush():
+            if inserts:
+                self.session.execute(
+                    text(
+                        "INSERT INTO items (id, type, name, id_path, parent_id, md5, md5_s,"
+                        " size, total_size, file_count)"
+                        " VALUES (:id, :type, :name, :id_path, :parent_id, :md5, :md5_s,"
+                        " :size, :total_size, :file_count)"
+                    ),
+                    inserts,
+                )
+                inserts.clear()
+            if updates:
+                self.session.execute(
+                    text(
+                        "UPDATE items SET size = :size, total_size = :size,"
+                        " md5 = :md5, md5_s = :md5_s WHERE id = :id"
+                    ),
+                    updates,
+                )
+                updates.clear()
+            if totals:
+                self.session.execute(
+                    text(
+                        "UPDATE items SET total_size = total_size + :size,"
+                        " file_count = file_count + :count WHERE id = :id"
+                    ),
+                    [
+                        {"id": id, "size": total[0], "count": total[1]}
+                        for id, total in totals.items()
+                    ],
+                )
+                totals.clear()
+
+        try:
+            # dirs 中的目录 (可为空目录) 与文件的上级目录一样按需创建
+            for path in dirs_to_add:
+                key = tuple(self.get_relative_path(path).path)
+                if key and key[0] == "..":
+                    raise driveError(600, "Not in Drives")
+                get_dir(key)
+            for link in self.iter_links(links):
+                path = base_path + link.path
+                key = tuple(self.get_relative_path(path).path)
+                if not key or key[0] == "..":
+                    raise driveError(600, "Not in Drives")
+                try:
+                    parent_id, parent_id_path = get_dir(key[:-1])
+                except driveError as e:
+                    if policy != "skip":
+                        raise e
+                    stat["skipped"] += 1
+                    continue
+                entry = get_children(parent_id).get(key[-1])
+                if entry is None:
+                    id = next_id
+                    next_id += 1
+                    inserts.append(
+                        {
+                            "id": id,
+                            "type": 0,
+                            "name": key[-1],
+                            "id_path": parent_id_path.rstrip("/") + "/" + str(id),
+                            "parent_id": parent_id,
+                            "md5": link.md5,
+                            "md5_s": link.md5_s,
+                            "size": link.size,
+                            "total_size": link.size,
+                            "file_count": 1,
+                        }
+                    )
+                    children[parent_id][key[-1]] = (id, 0, link.size)
+                    add_totals(parent_id_path, link.size, 1)
+                    stat["added"] += 1
+                elif policy == "overwrite" and entry[1] == 0:
+                    updates.append(
+                        {
+                            "id": entry[0],
+                            "size": link.size,
+                            "md5": link.md5,
+                            "md5_s": link.md5_s,
+                        }
+                    )
+                    children[parent_id][key[-1]] = (entry[0], 0, link.size)
+                    add_totals(parent_id_path, link.size - (entry[2] or 0), 0)
+                    stat["overwritten"] += 1
+                elif policy == "skip":
+                    stat["skipped"] += 1
+                else:
+                    raise driveError(603, "Path already exists", data={"path": path})
+                uncommitted += 1
+                if len(inserts) + len(updates) >= batch_size:
+                    flush()
+                # fail 策略下整个导入在一个事务中, 中止时不留下前面的行
+                if uncommitted >= commit_size and policy != "fail":
+                    flush()
+                    self.session.commit()
+                    uncommitted = 0
+            flush()
+            self.session.commit()
+            self.index = None
+        except Exception as e:
+            self.session.rollback()
+            raise e
+        return stat
+
+    @unit
+    def export_snapshot(self, f, path: pathType = None) -> int:
+        # 按 id_path 顺序导出子树, 父目录总在子项之前, 只需保留目录 id -> 序号
+        path = path if path is not None else self.base_path
+        root_id = self.path_to_id(path)
+        if root_id != 0:
+            root = self.session.query(Items.type).filter_by(id=root_id).first()
+            if root.type != 1:
+                raise driveError(604, "Not a directory", data={"path": path})
+        low, high = self.get_subtree_range(root_id)
+        result = self.session.connection().exec_driver_sql(
+            "SELECT id, parent_id, type, name, size, md5, md5_s FROM items"
+            " WHERE id_path >= ? AND id_path < ? ORDER BY id_path",
+            (low, high),
+        )
+        index = {root_id: -1}
+
+        def iter_rows():
+            i = 0
+            while True:
+                rows = result.fetchmany(CHUNK_SIZE)
+                if not rows:
+                    break
+                for id, parent_id, type, name, size, md5, md5_s in rows:
+                    # 旧版本可能写入父项是文件的行, 这些行 (及其下的行) 不可达, 不导出
+                    if parent_id not in index:
+                        continue
+                    if type == 1:
+                        index[id] = i
+                    yield (index[parent_id], type, name, size, md5, md5_s)
+                    i += 1
+
+        return write_snapshot(f, iter_rows())
+
+    @writer
+    def import_snapshot(self, f, path: pathType = None) -> int:
+        # 序号 i 的项分配 id 为 base + i + 1, 无需 id 映射表
+        path = path if path is not None else self.base_path
+        try:
+            root_id = self.make_dirs(path)
+            if root_id != 0:
+                root = self.session.query(Items.type).filter_by(id=root_id).first()
+                if root.type != 1:
+                    raise driveError(604, "Not a directory", data={"path": path})
+            root_id_path = self.get_id_path(root_id).rstrip("/")
+            existing = {
+                row[0]
+                for row in self.session.execute(
+                    text("SELECT name FROM items WHERE parent_id = :id"),
+                    {"id": root_id},
+                )
+            }
+            base = self.session.execute(
+                text("SELECT COALESCE(MAX(id), 0) FROM items")
+            ).scalar()
+            # 目录序号 -> [id_path, 父目录序号, 总大小, 文件数]
+            dirs = {-1: [root_id_path, None, 0, 0]}
+            count = 0
+            for chunk in read_snapshot(f):
+                inserts = []
+                for parent, type, name, size, md5, md5_s in chunk:
+                    if parent == -1 and name in existing:
+                        raise driveError(
+                            603,
+                            "Path already exists",
+                            data={"path": path + pathType([name], False)},
+                        )
+                    if parent not in dirs:
+                        raise ValueError("Corrupt snapshot file")
+                    id = base + count + 1
+                    parent_dir = dirs[parent]
+                    id_path = parent_dir[0] + "/" + str(id)
+                    if type == 1:
+                        dirs[count] = [id_path, parent, 0, 0]
+                    else:
+                        parent_dir[2] += size
+                        parent_dir[3] += 1
+                    inserts.append(
+                        (
+                            id,
+                            type,
+                            name,
+                            id_path,
+                            root_id if parent == -1 else base + parent + 1,
+                            md5,
+                            md5_s,
+                            size,
+                            size if type == 0 else 0,
+                            1 if type == 0 else 0,
+                        )
+                    )
+                    count += 1
+                self.session.connection().exec_driver_sql(
+                    "INSERT INTO items (id, type, name, id_path, parent_id, md5, md5_s,"
+                    " size, total_size, file_count)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    inserts,
+                )
+            # 子目录序号总大于父目录, 逆序一遍即可向上汇总
+            for i in sorted(dirs, reverse=True):
+                if i != -1:
+                    parent_dir = dirs[dirs[i][1]]
+                    parent_dir[2] += dirs[i][2]
+                    parent_dir[3] += dirs[i][3]
+            totals = [
+                {"id": base + i + 1, "size": d[2], "count": d[3]}
+                for i, d in dirs.items()
+                if i != -1 and d[3]
+            ]
+            if totals:
+                self.session.execute(
+                    text(
+                        "UPDATE items SET total_size = :size, file_count = :count"
+                        " WHERE id = :id"
+                    ),
+                    totals,
+                )
+            self.update_totals(root_id, dirs[-1][2], dirs[-1][3])
+            self.session.commit()
+            self.index = None
+        except Exception as e:
+            self.session.rollback()
+            self.path_cache.clear()
+            self.id_cache.clear()
+            raise e
+        return count
@@ -1,5 +1,6 @@
-from helperType import pathType, itemType
+from helperType import pathType, itemType, linkType
 from fnmatch import fnmatch
+from collections import deque
 
 
 class driveError(Exception):
@@ -24,6 +25,15 @@ class pathNotFoundError(driveError):
         self.data = {"path": path}
 
 
+def has_wildcard(name: str) -> bool:
+    return any(c in name for c in "*?[")
+
+
+def match_name(name: str, patterns: list) -> bool:
+    # 与 parse_wildcard 一致: 名称完全相同或符合通配符
+    return any(name == pattern or fnmatch(name, pattern) for pattern in patterns)
+
+
 class driveInterface:
     base_path: pathType
     drive_type: str
@@ -46,11 +56,27 @@ class driveInterface:
             for p in path:
                 res_list.extend(self.parse_wildcard(p))
             return res_list
+        # 中间某级含通配符时由 walk 逐级展开, 同一级的目录一并列出
+        levels = path.path[:-1]
+        first = next((i for i, name in enumerate(levels) if has_wildcard(name)), None)
+        if first is None:
+            items = self.list_dir(path.dirname)
         else:
-            for item in self.list_dir(path.dirname):
-                if item.name == path.basename or fnmatch(item.name, path.basename):
-                    res_list.append(item.path)
-            return res_list
+            dirs = [pathType(levels[:first], path.absolute)]
+            for name in levels[first:]:
+                if has_wildcard(name):
+                    dirs = [
+                        item.path
+                        for item in self.walk(dirs, max_depth=1, include=[name])
+                        if item.type == 1
+                    ]
+                else:
+                    dirs = [dir + pathType([name], False) for dir in dirs]
+            items = self.walk(dirs, max_depth=1)
+        for item in items:
+            if match_name(item.name, [path.basename]):
+                res_list.append(item.path)
+        return res_list
 
     def get_relative_path(self, path: pathType) -> pathType:
         if not path.absolute:
@@ -73,6 +99,12 @@ class driveInterface:
     def search_items(self, **kwargs) -> list[itemType]:
         pass
 
+    def iter_dir(self, path: pathType):
+        yield from self.list_dir(path)
+
+    def iter_search_items(self, **kwargs):
+        yield from self.search_items(**kwargs)
+
     def move_item(self, src_path: pathType, dst_path: pathType, **kwargs) -> None:
         pass
 
@@ -85,6 +117,90 @@ class driveInterface:
     def add_item(self, path: pathType, type: int, **kwargs) -> None:
         pass
 
+    def walk(self, path, max_depth: int = None, include: list = None, exclude=None):
+        # 广度优先遍历 path (或路径列表) 下的所有项, 不含 path 本身; max_depth 为 1 时只列出直接子项
+        # include 只决定产出哪些项; 匹配 exclude 的项既不产出也不进入; 遍历中消失的目录被忽略
+        queue = deque((root, 1) for root in (path if type(path) == list else [path]))
+        while queue:
+            dir_path, depth = queue.popleft()
+            try:
+                items = self.list_dir(dir_path)
+            except pathNotFoundError:
+                continue
+            for item in items:
+                if exclude and match_name(item.name, exclude):
+                    continue
+                if not include or match_name(item.name, include):
+                    yield item
+                if item.type == 1 and (max_depth is None or depth < max_depth):
+                    queue.append((item.path, depth + 1))
+
+    def disk_usage(self, path: pathType, depth: int = 0):
+        # 遍历整棵子树, 自底向上汇总目录大小
+        item = self.get_item(path)
+        if item.type == 0:
+            yield path, int(item.data["size"] or 0), 1
+            return
+        sizes = {path: [0, 0]}
+        children = {path: []}
+        for item in self.walk(path):
+            if item.type == 1:
+                sizes.setdefault(item.path, [0, 0])
+                children.setdefault(item.path, [])
+                children.setdefault(item.path.dirname, []).append(item.path)
+            else:
+                size = sizes.setdefault(item.path.dirname, [0, 0])
+                size[0] += int(item.data["size"] or 0)
+                size[1] += 1
+        order = [path]
+        for dir_path in order:
+            order.extend(children[dir_path])
+        for dir_path in reversed(order):
+            for sub_path in children[dir_path]:
+                sizes[dir_path][0] += sizes[sub_path][0]
+                sizes[dir_path][1] += sizes[sub_path][1]
+        for dir_path in order:
+            if len(dir_path) - len(path) <= depth:
+                yield dir_path, sizes[dir_path][0], sizes[dir_path][1]
+
+    def iter_links(self, links):
+        for link in links:
+            if isinstance(link, linkType):
+                yield link
+            elif link.strip():
+                try:
+                    yield linkType.link_from_str(link)
+                except ValueError:
+                    raise driveError(605, "Invalid link", data={"link": link.strip()})
+
+    def bulk_add(self, links, **kwargs) -> dict:
+        base_path = kwargs["path"] if "path" in kwargs else self.base_path
+        policy = kwargs["policy"] if "policy" in kwargs else "skip"
+        stat = {"added": 0, "skipped": 0, "overwritten": 0}
+        for path in sorted(kwargs["dirs"] if "dirs" in kwargs else [], key=len):
+            try:
+                self.add_item(path, 1)
+            except driveError as e:
+                if e.code != 603:
+                    raise e
+        for link in self.iter_links(links):
+            path = base_path + link.path
+            try:
+                self.add_item(
+                    path,
+                    0,
+                    md5=link.md5,
+                    md5_s=link.md5_s,
+                    size=link.size,
+                    force=policy == "overwrite",
+                )
+                stat["added"] += 1
+            except driveError as e:
+                if e.code != 603 or policy == "fail":
+                    raise e
+                stat["skipped"] += 1
+        return stat
+
 
 class driveUnion(driveInterface):
     drives: list[driveInterface]
@@ -112,17 +228,18 @@ class driveUnion(driveInterface):
         self.drives.append(drive)
 
     def list_dir(self, path: pathType) -> list[itemType]:
+        return list(self.iter_dir(path))
+
+    def iter_dir(self, path: pathType):
         drive = self.get_drive_by_path(path)
         if drive:
-            return drive.list_dir(path)
+            yield from drive.iter_dir(path)
         else:
-            res_list = []
             drives = self.get_drives_in_path(path)
             for drive in drives:
                 name = (drive.base_path - path)[0]
                 item_path = path + pathType([name], False)
-                res_list.append(itemType(path=item_path, type=1, data={}))
-            return res_list
+                yield itemType(path=item_path, type=1, data={})
 
     def get_item(self, path: pathType) -> itemType:
         drive = self.get_drive_by_path(path)
@@ -136,6 +253,9 @@ class driveUnion(driveInterface):
                 raise pathNotFoundError(path)
 
     def search_items(self, **kwargs) -> list[itemType]:
+        return list(self.iter_search_items(**kwargs))
+
+    def iter_search_items(self, **kwargs):
         path_list = []
         if "path" in kwargs:
             if type(kwargs["path"]) == type([]):
@@ -161,12 +281,10 @@ class driveUnion(driveInterface):
                         search_list[drive].append(drive.base_path)
                     else:
                         search_list[drive] = [drive.base_path]
-        res_list = []
         for drive in search_list:
             search_arg = kwargs.copy()
             search_arg.update({"path": search_list[drive]})
-            res_list.extend(drive.search_items(**search_arg))
-        return res_list
+            yield from drive.iter_search_items(**search_arg)
 
     def move_item(self, src_path: pathType, dst_path: pathType, **kwargs) -> None:
         src_drive = self.get_drive_by_path(src_path)
@@ -208,29 +326,36 @@ class driveUnion(driveInterface):
             except pathNotFoundError:
                 if len(src_path_list) > 1:
                     raise pathNotFoundError(dst_path)
+            # 先收集全部文件和目录, 交给目标驱动的 bulk_add 一次添加; 空目录经 dirs 一并创建
+            links = []
+            dirs = []
             for src_path in src_path_list:
                 src_item = self.get_item(src_path)
                 if src_item.type == 1 and not (
                     "recursive" in kwargs and kwargs["recursive"]
                 ):
                     raise driveError(602, "Is a directory", data={"path": src_path})
-                dst_drive.add_item(
-                    path=(dst_path + pathType([src_item.name], False))
-                    if flag
-                    else dst_path,
-                    type=src_item.type,
-                    size=src_item.data["size"],
-                    md5=src_item.data["md5"],
-                    md5_s=src_item.data["md5_s"],
+                target = (
+                    dst_path + pathType([src_item.name], False) if flag else dst_path
                 )
-                if src_item.type == 1:
-                    items = src_drive.list_dir(src_path)
-                    for item in items:
-                        self.copy_item(
-                            src_path + pathType([item.name], False),
-                            dst_path + pathType([item.name], False),
-                            **kwargs
+                for item, path in self.iter_copy_items(src_drive, src_item, target):
+                    if item.type == 1:
+                        dirs.append(path)
+                    else:
+                        links.append(
+                            linkType(
+                                item.data["md5"],
+                                item.data["md5_s"],
+                                int(item.data["size"]),
+                                path,
+                            )
                         )
+            dst_drive.bulk_add(
+                links,
+                path=dst_drive.base_path,
+                policy="overwrite" if "force" in kwargs and kwargs["force"] else "fail",
+                dirs=dirs,
+            )
         else:
             raise driveError(
                 601,
@@ -238,6 +363,16 @@ class driveUnion(driveInterface):
                 data={"drives": [src_drive, dst_drive]},
             )
 
+    def iter_copy_items(self, src_drive: driveInterface, src_item: itemType, target):
+        # 广度优先列出源项及其下所有项, 产出 (项, 目标路径)
+        queue = deque([(src_item, target)])
+        while queue:
+            item, path = queue.popleft()
+            yield item, path
+            if item.type == 1:
+                for child in src_drive.iter_dir(item.path):
+                    queue.append((child, path + pathType([child.name], False)))
+
     def remove_item(self, path: pathType, **kwargs) -> None:
         drive = self.get_drive_by_path(path)
         if not drive:
@@ -249,3 +384,47 @@ class driveUnion(driveInterface):
         if not drive:
             raise driveError(600, "Not in Drives")
         drive.add_item(path, type, **kwargs)
+
+    def walk(self, path, max_depth: int = None, include: list = None, exclude=None):
+        # 按所在驱动分组交给各驱动遍历, 不在任何驱动中的路径逐级列出
+        roots = {}
+        for root in path if type(path) == list else [path]:
+            roots.setdefault(self.get_drive_by_path(root), []).append(root)
+        for drive, paths in roots.items():
+            if drive:
+                yield from drive.walk(paths, max_depth, include, exclude)
+            else:
+                yield from driveInterface.walk(self, paths, max_depth, include, exclude)
+
+    def disk_usage(self, path: pathType, depth: int = 0):
+        drive = self.get_drive_by_path(path)
+        if not drive:
+            raise driveError(600, "Not in Drives")
+        yield from drive.disk_usage(path, depth)
+
+    def bulk_add(self, links, **kwargs) -> dict:
+        base_path = kwargs["path"] if "path" in kwargs else self.base_path
+        drive = self.get_drive_by_path(base_path)
+        if drive:
+            return drive.bulk_add(links, **kwargs)
+        # 不在任何驱动中 (如联合根目录) 时按每个链接的完整路径分组, 交给各自所在的驱动
+        groups = {}
+        for link in self.iter_links(links):
+            path = base_path + link.path
+            drive = self.get_drive_by_path(path)
+            if not drive:
+                raise driveError(600, "Not in Drives", data={"path": path})
+            groups.setdefault(drive, ([], []))[0].append(
+                linkType(link.md5, link.md5_s, link.size, drive.get_relative_path(path))
+            )
+        for path in kwargs["dirs"] if "dirs" in kwargs else []:
+            drive = self.get_drive_by_path(path)
+            if not drive:
+                raise driveError(600, "Not in Drives", data={"path": path})
+            groups.setdefault(drive, ([], []))[1].append(path)
+        stat = {"added": 0, "skipped": 0, "overwritten": 0}
+        for drive, (drive_links, dirs) in groups.items():
+            drive_kwargs = dict(kwargs, path=drive.base_path, dirs=dirs)
+            for key, value in drive.bulk_add(drive_links, **drive_kwargs).items():
+                stat[key] = stat.get(key, 0) + value
+        return stat
@@ -0,0 +1,291 @@
+import json
+import time
+import random
+import threading
+import itertools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class fakeBaidu:
+    # 进程内的百度网盘接口替身, 目录树保存在内存中, 用于测试和基准测试 Pan
+    # latency: 每个请求的延迟秒数, page_size/search_page_size: list/search 每页最多返回的项数
+    # throttle: 请求被限流 (返回 throttle_errno) 的概率, known: 可秒传的 md5 集合, None 表示任意小写 md5
+    def __init__(
+        self,
+        latency: float = 0,
+        page_size: int = 1000,
+        search_page_size: int = 100,
+        throttle: float = 0,
+        throttle_errno: int = 111,
+        known: set = None,
+        task_polls: int = 2,
+    ):
+        self.latency = float(latency)
+        self.page_size = int(page_size)
+        self.search_page_size = int(search_page_size)
+        self.throttle = float(throttle)
+        self.throttle_errno = int(throttle_errno)
+        self.known = known
+        self.task_polls = int(task_polls)
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.nodes = {"/": {"isdir": 1, "children": {}, "mtime": time.time()}}
+        self.tasks = {}
+        # 每个请求的 (接口名, 耗时), 供基准测试统计
+        self.requests = []
+        self.server = None
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.requests = []
+
+    def counts(self) -> dict:
+        res = {}
+        for name, _ in self.requests:
+            res[name] = res.get(name, 0) + 1
+        return res
+
+    # 目录树
+    def parent(self, path: str) -> str:
+        return path.rsplit("/", 1)[0] or "/"
+
+    def join(self, dir: str, name: str) -> str:
+        return dir.rstrip("/") + "/" + name
+
+    def touch(self, path: str) -> None:
+        self.nodes[path]["mtime"] = time.time()
+
+    def mkdirs(self, path: str) -> None:
+        with self.lock:
+            if path in self.nodes:
+                return
+            self.mkdirs(self.parent(path))
+            self.nodes[path] = {
+                "isdir": 1,
+                "children": {},
+                "fs_id": next(self.ids),
+                "mtime": time.time(),
+            }
+            self.nodes[self.parent(path)]["children"][path.rsplit("/", 1)[1]] = path
+            self.touch(self.parent(path))
+
+    def add_file(self, path: str, md5: str, size: int) -> None:
+        with self.lock:
+            self.mkdirs(self.parent(path))
+            self.nodes[path] = {
+                "isdir": 0,
+                "md5": md5,
+                "size": int(size),
+                "fs_id": next(self.ids),
+                "mtime": time.time(),
+            }
+            self.nodes[self.parent(path)]["children"][path.rsplit("/", 1)[1]] = path
+            self.touch(self.parent(path))
+
+    def remove(self, path: str) -> None:
+        with self.lock:
+            node = self.nodes.pop(path)
+            if node["isdir"]:
+                for child in list(node["children"].values()):
+                    self.remove(child)
+            parent = self.nodes.get(self.parent(path))
+            if parent:
+                parent["children"].pop(path.rsplit("/", 1)[1], None)
+                self.touch(self.parent(path))
+
+    def copy(self, src: str, dst: str) -> None:
+        with self.lock:
+            node = self.nodes[src]
+            if node["isdir"]:
+                self.mkdirs(dst)
+                for name, child in list(node["children"].items()):
+                    self.copy(child, self.join(dst, name))
+            else:
+                self.add_file(dst, node["md5"], node["size"])
+
+    def blocked(self, path: str) -> bool:
+        # 某一级上级是文件时无法在其下创建
+        while path != "/":
+            path = self.parent(path)
+            if path in self.nodes and not self.nodes[path]["isdir"]:
+                return True
+        return False
+
+    def entry(self, path: str) -> dict:
+        node = self.nodes[path]
+        res = {
+            "fs_id": node["fs_id"],
+            "path": path,
+            "server_filename": path.rsplit("/", 1)[1],
+            "isdir": node["isdir"],
+            "server_mtime": int(node["mtime"] * 1000),
+            "size": 0,
+        }
+        if not node["isdir"]:
+            res["md5"] = node["md5"]
+            res["size"] = node["size"]
+        return res
+
+    # 接口
+    def handle(self, name: str, query: dict, form: dict) -> dict:
+        start = time.monotonic()
+        if self.latency:
+            time.sleep(self.latency)
+        if (
+            name != "gettemplatevariable"
+            and self.throttle
+            and random.random() < self.throttle
+        ):
+            res = {"errno": self.throttle_errno, "errmsg": "busy"}
+        elif not hasattr(self, "api_" + name):
+            res = {"errno": -1, "errmsg": "unknown api"}
+        else:
+            with self.lock:
+                res = getattr(self, "api_" + name)(query, form)
+        with self.lock:
+            self.requests.append((name, time.monotonic() - start))
+        return res
+
+    def api_gettemplatevariable(self, query: dict, form: dict) -> dict:
+        return {"errno": 0, "result": {"bdstoken": "fake"}}
+
+    def api_list(self, query: dict, form: dict) -> dict:
+        dir = query.get("dir", "/")
+        if dir not in self.nodes or not self.nodes[dir]["isdir"]:
+            return {"errno": -9}
+        page = int(query.get("page", 1))
+        num = min(int(query.get("num", 1000)), self.page_size)
+        children = self.nodes[dir]["children"]
+        names = sorted(children)[(page - 1) * num : page * num]
+        return {"errno": 0, "list": [self.entry(children[name]) for name in names]}
+
+    def api_rapidupload(self, query: dict, form: dict) -> dict:
+        path, md5 = form["path"], form["content-md5"]
+        if md5 != md5.lower() or (self.known is not None and md5 not in self.known):
+            return {"errno": 404}
+        if path in self.nodes:
+            return {"errno": -8}
+        if self.blocked(path):
+            return {"errno": 2, "errmsg": "parent is a file"}
+        self.add_file(path, md5, form["content-length"])
+        return {"errno": 0}
+
+    def api_create(self, query: dict, form: dict) -> dict:
+        path = form["path"]
+        if path in self.nodes:
+            return {"errno": -8}
+        if self.blocked(path):
+            return {"errno": 2, "errmsg": "parent is a file"}
+        self.mkdirs(path)
+        return {"errno": 0}
+
+    def api_search(self, query: dict, form: dict) -> dict:
+        prefix = query.get("dir", "/").rstrip("/") + "/"
+        key = query["key"].lower()
+        page = int(query.get("page", 1))
+        paths = sorted(
+            path
+            for path in self.nodes
+            if path != "/"
+            and path.startswith(prefix)
+            and key in path.rsplit("/", 1)[1].lower()
+        )
+        num = self.search_page_size
+        return {
+            "errno": 0,
+            "list": [self.entry(path) for path in paths[(page - 1) * num : page * num]],
+            "has_more": 1 if page * num < len(paths) else 0,
+        }
+
+    def api_filemanager(self, query: dict, form: dict) -> dict:
+        opera = query["opera"]
+        info = []
+        for file in json.loads(form["filelist"]):
+            src = file if type(file) == str else file["path"]
+            errno = 0
+            if src not in self.nodes:
+                errno = -9
+            elif opera == "delete":
+                self.remove(src)
+            elif file["dest"] not in self.nodes:
+                errno = -9
+            elif self.join(file["dest"], file["newname"]) in self.nodes:
+                errno = -8
+            else:
+                self.copy(src, self.join(file["dest"], file["newname"]))
+                if opera == "move":
+                    self.remove(src)
+            info.append({"errno": errno, "path": src})
+        failed = any(item["errno"] != 0 for item in info)
+        res = {"errno": 12 if failed else 0, "info": info}
+        if query.get("async") == "2":
+            taskid = next(self.ids)
+            self.tasks[taskid] = [self.task_polls, res]
+            return {"errno": 0, "taskid": taskid}
+        return res
+
+    def api_taskquery(self, query: dict, form: dict) -> dict:
+        task = self.tasks[int(query["taskid"])]
+        if task[0] > 0:
+            task[0] -= 1
+            return {"errno": 0, "status": "running"}
+        res = task[1]
+        return {
+            "errno": 0,
+            "status": "success" if res["errno"] == 0 else "failed",
+            "task_errno": res["errno"],
+            "list": res["info"],
+        }
+
+    # 服务
+    def serve(self) -> str:
+        # 在后台线程中启动服务, 返回 api 接口地址; share 接口地址见 share_base
+        fake = self
+
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, form: dict):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                name = url.path.rstrip("/").rsplit("/", 1)[-1]
+                body = json.dumps(fake.handle(name, query, form)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except ConnectionError:
+                    pass
+
+            def do_GET(self):
+                self.reply({})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode("utf-8"))
+                self.reply({k: v[0] for k, v in form.items()})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.api_base
+
+    @property
+    def api_base(self) -> str:
+        return "http://127.0.0.1:{}/api/".format(self.server.server_address[1])
+
+    @property
+    def share_base(self) -> str:
+        return "http://127.0.0.1:{}/share/".format(self.server.server_address[1])
+
+    def shutdown(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
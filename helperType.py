@@ -1,3 +1,9 @@
+import time
+import random
+import threading
+from collections import OrderedDict
+
+
 class pathType:
     @staticmethod
     def path_from_str(path_s: str, **kwargs):
@@ -92,3 +98,130 @@ class itemType:
         self.name = self.path.basename
         self.type = type
         self.data = data
+
+
+class linkType:
+    @staticmethod
+    def link_from_str(link_s: str):
+        data = link_s.strip().split("#")
+        if len(data) != 4 or not data[3]:
+            raise ValueError("Invalid link: {}".format(link_s))
+        # 哈希统一为小写, 与秒传接口接受的形式一致
+        return linkType(
+            data[0].lower(),
+            data[1].lower(),
+            int(data[2]),
+            pathType.path_from_str(data[3]),
+        )
+
+    md5: str
+    md5_s: str
+    size: int
+    path: pathType
+
+    def __init__(self, md5: str, md5_s: str, size: int, path: pathType):
+        self.md5 = md5
+        self.md5_s = md5_s
+        self.size = size
+        self.path = path
+
+    def __repr__(self):
+        return "#".join([self.md5, self.md5_s, str(self.size), str(self.path)])
+
+
+class lruCache:
+    max_size: int
+
+    def __init__(self, max_size: int = 65536):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.data.pop(key, default)
+
+    def items(self):
+        with self.lock:
+            return list(self.data.items())
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class rateLimiter:
+    # 令牌桶限速: 被限流时速率减半并指数退避, 每次成功后速率线性恢复到 max_rate
+    rate: float
+
+    def __init__(
+        self,
+        max_rate: float = 100,
+        min_rate: float = 0.5,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+    ):
+        self.max_rate = float(max_rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.rate = self.max_rate
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.tokens = max(1.0, self.max_rate)
+        self.stamp = time.monotonic()
+        self.failures = 0
+        self.cut_stamp = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self) -> float:
+        # 预先扣除令牌并返回需等待的秒数, 调用方在锁外等待, 令并发的调用按到达顺序排队
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                max(1.0, self.rate), self.tokens + (now - self.stamp) * self.rate
+            )
+            self.stamp = now
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def throttled(self) -> float:
+        # 返回本次应退避的秒数 (带随机抖动)
+        with self.lock:
+            # 并发请求同时被限流只算一次, 避免速率被连续减半
+            now = time.monotonic()
+            if now - self.cut_stamp >= self.backoff:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.cut_stamp = now
+            self.tokens = min(self.tokens, 0)
+            self.failures += 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+        return random.uniform(delay / 2, delay)
+
+    def succeeded(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
@@ -2,7 +2,7 @@ import os
 import cmd2
 from baiduUtil import Pan
 from dbUtil import DB
-from helperType import pathType, itemType
+from helperType import pathType, linkType
 from driveInterface import *
 import json
 
@@ -29,19 +29,20 @@ class LibraryShell(cmd2.Cmd):
                 f.write("[]")
 
     def add_drive(self, drive: dict):
+        kwargs = drive["kwargs"] if "kwargs" in drive else {}
         if drive["type"] == "database":
             self.drives.add_drive(
-                DB(pathType.path_from_str(drive["path"]), *drive["args"])
+                DB(pathType.path_from_str(drive["path"]), *drive["args"], **kwargs)
             )
         elif drive["type"] == "baidunetdisk":
             self.drives.add_drive(
-                Pan(pathType.path_from_str(drive["path"]), *drive["args"])
+                Pan(pathType.path_from_str(drive["path"]), *drive["args"], **kwargs)
             )
 
     def get_prompt(self) -> str:
         return str(self.now_path) + " > "
 
-    def list_items(self, items: list[itemType], one_item_per_line: bool):
+    def list_items(self, items, one_item_per_line: bool):
         for item in items:
             name_str = str(item.path - self.now_path)
             if " " in name_str:
@@ -93,12 +94,12 @@ class LibraryShell(cmd2.Cmd):
     def do_ls(self, args):
         """List information about the FILEs (the current directory by default)."""
         if not args.path:
-            items = self.drives.list_dir(self.now_path)
+            items = self.drives.iter_dir(self.now_path)
             self.list_items(items, args.list)
         else:
             for path in args.path:
                 self.poutput("{} :".format(path))
-                items = self.drives.list_dir(
+                items = self.drives.iter_dir(
                     self.now_path + pathType.path_from_str(path)
                 )
                 self.list_items(items, args.list)
@@ -141,9 +142,71 @@ class LibraryShell(cmd2.Cmd):
                 search_args["min_size"] = args.size
             elif args.size < 0:
                 search_args["max_size"] = abs(args.size)
-        items = self.drives.search_items(**search_args)
+        items = self.drives.iter_search_items(**search_args)
         self.list_items(items, True)
 
+    du_parser = cmd2.Cmd2ArgumentParser()
+    du_parser.add_argument(
+        "-d",
+        "-depth",
+        "--depth",
+        default=0,
+        type=int,
+        help="Also list directories up to DEPTH levels below PATH",
+    )
+    du_parser.add_argument(
+        "path", nargs="*", help="Path to summarize, default to current directory."
+    )
+
+    @cmd2.with_argparser(du_parser)
+    def do_du(self, args):
+        """Summarize the total size and file count of directories."""
+        for path in args.path or ["."]:
+            path = self.now_path + pathType.path_from_str(path)
+            try:
+                for dir_path, size, count in self.drives.disk_usage(path, args.depth):
+                    name_str = str(dir_path - self.now_path) or "."
+                    self.poutput(
+                        cmd2.utils.align_left(str(size), width=16)
+                        + cmd2.utils.align_left(str(count), width=16)
+                        + name_str
+                    )
+            except driveError as e:
+                self.perror("du : {} {}".format(e.message, str(e.data.get("path", ""))))
+
+    dupes_parser = cmd2.Cmd2ArgumentParser()
+    dupes_parser.add_argument(
+        "-d",
+        "-delete",
+        "--delete",
+        action="store_true",
+        help="Keep the first item of each group and delete the others",
+    )
+    dupes_parser.add_argument(
+        "path", nargs="*", help="Path to search, default to current directory."
+    )
+
+    @cmd2.with_argparser(dupes_parser)
+    def do_dupes(self, args):
+        """Find files with the same content (md5 and size)."""
+        search_list: dict[driveInterface, list[pathType]] = {}
+        for path in args.path or ["."]:
+            path = self.now_path + pathType.path_from_str(path)
+            drive = self.drives.get_drive_by_path(path)
+            if not drive or drive.drive_type != "database":
+                self.perror("dupes : Only database drives are supported.")
+                return
+            search_list.setdefault(drive, []).append(path)
+        for drive in search_list:
+            for items in drive.find_duplicates(path=search_list[drive]):
+                self.poutput(
+                    "{} {} :".format(items[0].data["md5"], items[0].data["size"])
+                )
+                self.list_items(items, True)
+            if args.delete:
+                count = drive.remove_duplicates(path=search_list[drive])
+                self.poutput("dupes : {} items deleted.".format(count))
+
     cp_parser = cmd2.Cmd2ArgumentParser()
     cp_parser.add_argument("src_path", help="Source")
     cp_parser.add_argument("dst_path", help="Dest")
@@ -264,9 +327,12 @@ class LibraryShell(cmd2.Cmd):
         path_list = []
         for path in args.path:
             search_path_list.append(self.now_path + pathType.path_from_str(path))
-        for ext in ["*.7z", "*.zip"]:
-            items = self.drives.search_items(path=search_path_list, name=ext)
-            for item in items:
+        # 一次遍历找出含压缩包的目录, 百度网盘驱动会并行列出各级目录
+        for item in self.drives.walk(search_path_list):
+            if item.type == 0 and os.path.splitext(item.name)[-1].lower() in (
+                ".7z",
+                ".zip",
+            ):
                 if item.path.dirname not in path_list:
                     path_list.append(item.path.dirname)
         res_list = []
@@ -297,13 +363,159 @@ class LibraryShell(cmd2.Cmd):
     @cmd2.with_argparser(add_parser)
     def do_add(self, args):
         """Add files to a drive by rapid-upload link."""
+        # 按驱动分组后批量添加, 百度网盘驱动会并行秒传并按输入顺序报告每一项
+        groups = {}
         for link in args.link:
-            data = link.split("#")
-            if len(data) != 4:
+            try:
+                link = linkType.link_from_str(link)
+            except ValueError:
                 self.perror("add : Invalid link.")
                 return
-            path = self.now_path + pathType.path_from_str(data[3])
-            self.drives.add_item(path, 0, md5=data[0], md5_s=data[1], size=data[2])
+            path = self.now_path + link.path
+            drive = self.drives.get_drive_by_path(path)
+            if not drive:
+                self.perror("add : 600 Not in Drives {}".format(path))
+                return
+            groups.setdefault(drive, []).append(
+                linkType(link.md5, link.md5_s, link.size, path)
+            )
+
+        def report(link, path, error):
+            if error is not None:
+                self.perror("add : {} : {} {}".format(path, error.code, error.message))
+
+        for drive, links in groups.items():
+            try:
+                stat = drive.bulk_add(
+                    links, path=drive.base_path, policy="skip", report=report
+                )
+            except driveError as e:
+                self.perror("add : {} {} {}".format(e.code, e.message, e.data))
+                return
+            if stat["skipped"] or ("failed" in stat and stat["failed"]):
+                self.poutput(
+                    "add : {} added, {} skipped, {} failed.".format(
+                        stat["added"],
+                        stat["skipped"],
+                        stat["failed"] if "failed" in stat else 0,
+                    )
+                )
+
+    bulkadd_parser = cmd2.Cmd2ArgumentParser()
+    bulkadd_parser.add_argument(
+        "file", help="File with one rapid-upload link per line", nargs="+"
+    )
+    bulkadd_parser.add_argument(
+        "-p",
+        "-policy",
+        "--policy",
+        choices=["skip", "overwrite", "fail"],
+        default="skip",
+        help="What to do when an item already exists",
+    )
+
+    @cmd2.with_argparser(bulkadd_parser)
+    def do_bulkadd(self, args):
+        """Add files to the current directory from rapid-upload link files."""
+        for file in args.file:
+            with open(file, "r", encoding="utf-8") as f:
+                try:
+                    stat = self.drives.bulk_add(
+                        f, path=self.now_path, policy=args.policy
+                    )
+                except driveError as e:
+                    self.perror("bulkadd : {} {} {}".format(e.code, e.message, e.data))
+                    return
+            self.poutput(
+                "bulkadd : {} : {} added, {} overwritten, {} skipped.".format(
+                    file, stat["added"], stat["overwritten"], stat["skipped"]
+                )
+            )
+
+    mirror_parser = cmd2.Cmd2ArgumentParser()
+    mirror_parser.add_argument(
+        "-f",
+        "-full",
+        "--full",
+        action="store_true",
+        help="Compare every directory with the mirror, not only those whose mtime changed",
+    )
+    mirror_parser.add_argument(
+        "path", nargs="*", help="Path to refresh, default to current directory."
+    )
+
+    @cmd2.with_argparser(mirror_parser)
+    def do_mirror(self, args):
+        """Refresh the local mirror of a BaiduNetDisk drive."""
+        for path in args.path or ["."]:
+            path = self.now_path + pathType.path_from_str(path)
+            drive = self.drives.get_drive_by_path(path)
+            if not drive or drive.drive_type != "baidunetdisk" or drive.mirror is None:
+                self.perror("mirror : No mirror configured for {}".format(path))
+                continue
+            try:
+                stat = drive.mirror.refresh(path, args.full)
+            except driveError as e:
+                self.perror("mirror : {} {} {}".format(e.code, e.message, e.data))
+                continue
+            self.poutput(
+                "mirror : {} : {} directories listed, {} added, {} removed.".format(
+                    path, stat["listed"], stat["added"], stat["removed"]
+                )
+            )
+
+    export_parser = cmd2.Cmd2ArgumentParser()
+    export_parser.add_argument("file", help="Snapshot file to write")
+    export_parser.add_argument(
+        "path", nargs="?", default=".", help="Directory to export, default to current."
+    )
+
+    @cmd2.with_argparser(export_parser)
+    def do_export(self, args):
+        """Export a directory of a database drive to a snapshot file."""
+        path = self.now_path + pathType.path_from_str(args.path)
+        drive = self.drives.get_drive_by_path(path)
+        if not drive or drive.drive_type != "database":
+            self.perror("export : Only database drives are supported.")
+            return
+        try:
+            # 先检查源目录, 避免截断已有的输出文件
+            if drive.get_item(path).type != 1:
+                raise driveError(604, "Not a directory", data={"path": path})
+            with open(args.file, "wb") as f:
+                count = drive.export_snapshot(f, path)
+        except driveError as e:
+            self.perror("export : {} {} {}".format(e.code, e.message, e.data))
+            return
+        self.poutput("export : {} items exported.".format(count))
+
+    import_parser = cmd2.Cmd2ArgumentParser()
+    import_parser.add_argument("file", help="Snapshot file to read")
+    import_parser.add_argument(
+        "path",
+        nargs="?",
+        default=".",
+        help="Directory to import into, default to current.",
+    )
+
+    @cmd2.with_argparser(import_parser)
+    def do_import(self, args):
+        """Import a snapshot file into a directory of a database drive."""
+        path = self.now_path + pathType.path_from_str(args.path)
+        drive = self.drives.get_drive_by_path(path)
+        if not drive or drive.drive_type != "database":
+            self.perror("import : Only database drives are supported.")
+            return
+        try:
+            with open(args.file, "rb") as f:
+                count = drive.import_snapshot(f, path)
+        except driveError as e:
+            self.perror("import : {} {} {}".format(e.code, e.message, e.data))
+            return
+        except ValueError as e:
+            self.perror("import : {}".format(e))
+            return
+        self.poutput("import : {} items imported.".format(count))
 
     getlink_parser = cmd2.Cmd2ArgumentParser()
     getlink_parser.add_argument("path", help="Path", nargs="+")
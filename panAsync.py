@@ -0,0 +1,93 @@
+import atexit
+import asyncio
+import threading
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class asyncTransport:
+    # 在后台线程的事件循环上用 aiohttp 执行 Pan 的接口调用生成器, 单个线程即可维持大量并发请求
+    # call/submit 为同步外观, 接口逻辑全部在 Pan 的调用生成器中
+    def __init__(self, pan, connections: int = 100):
+        if aiohttp is None:
+            raise ImportError("Transport 'asyncio' requires aiohttp")
+        self.pan = pan
+        self.connections = int(connections)
+        self.session = None
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        atexit.register(self.close)
+
+    def get_session(self):
+        if self.session is None:
+            headers = dict(self.pan.request_header)
+            # aiohttp 未安装 brotli 时无法解码 br
+            headers["Accept-Encoding"] = "gzip, deflate"
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections, ssl=False),
+                headers=headers,
+            )
+        return self.session
+
+    async def request(self, method: str, url: str, **kwargs) -> dict:
+        from baiduUtil import THROTTLE_ERRNOS, REQUEST_RETRIES
+
+        session = self.get_session()
+        timeout = aiohttp.ClientTimeout(
+            total=kwargs.pop("timeout") if "timeout" in kwargs else 15
+        )
+        kwargs.setdefault("allow_redirects", False)
+        for key in ("params", "data"):
+            if key in kwargs:
+                kwargs[key] = {k: str(v) for k, v in kwargs[key].items()}
+        for attempt in range(REQUEST_RETRIES):
+            await asyncio.sleep(self.pan.limiter.reserve())
+            try:
+                async with session.request(
+                    method, url, timeout=timeout, **kwargs
+                ) as response:
+                    res = await response.json(content_type=None)
+            except aiohttp.ClientConnectionError as e:
+                if attempt == REQUEST_RETRIES - 1:
+                    raise e
+                await asyncio.sleep(self.pan.limiter.throttled())
+                continue
+            if res.get("errno") not in THROTTLE_ERRNOS:
+                self.pan.limiter.succeeded()
+                return res
+            if attempt < REQUEST_RETRIES - 1:
+                await asyncio.sleep(self.pan.limiter.throttled())
+        return res
+
+    async def run(self, gen):
+        # 与 Pan.call 相同的协议: 生成器产出请求或等待的秒数
+        try:
+            step = next(gen)
+            while True:
+                try:
+                    if isinstance(step, tuple):
+                        res = await self.request(step[0], step[1], **step[2])
+                    else:
+                        await asyncio.sleep(step)
+                        res = None
+                except Exception as e:
+                    step = gen.throw(e)
+                    continue
+                step = gen.send(res)
+        except StopIteration as e:
+            return e.value
+
+    def submit(self, gen):
+        return asyncio.run_coroutine_threadsafe(self.run(gen), self.loop)
+
+    def call(self, gen):
+        return self.submit(gen).result()
+
+    def close(self) -> None:
+        if self.session is not None:
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+            self.session = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
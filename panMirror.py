@@ -0,0 +1,180 @@
+import glob
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sqlalchemy import text
+from dbUtil import DB
+from helperType import pathType, itemType, linkType
+from driveInterface import *
+
+
+class panMirror:
+    # 将 Pan 驱动的目录树镜像到本地 SQLite, 目录 mtime 按路径记录在 mirror_dirs 中
+    # 百度只更新直接包含变化的目录的 server_mtime, 更深处的变化不会反映到上级, 因此刷新时仍列出每个目录,
+    # mtime 未变的目录只是不再与镜像逐项比对. 两次刷新之间, 不经本驱动的改动 (网页端、其他客户端) 不会反映到镜像中
+    db: DB
+
+    def __init__(self, pan, db_file: str):
+        self.pan = pan
+        self.db = DB(pan.base_path, db_file)
+        self.db.session.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS mirror_dirs"
+                " (path VARCHAR PRIMARY KEY, mtime INTEGER)"
+            )
+        )
+        self.db.session.commit()
+
+    def is_ready(self) -> bool:
+        # 根目录至少完整列出过一次
+        return (
+            self.db.session.execute(
+                text("SELECT COUNT(*) FROM mirror_dirs WHERE path = '/'")
+            ).scalar()
+            > 0
+        )
+
+    def to_pan_item(self, item: itemType) -> itemType:
+        item.data["drive_type"] = "baidunetdisk"
+        return item
+
+    def iter_dir(self, path: pathType):
+        for item in self.db.iter_dir(path):
+            yield self.to_pan_item(item)
+
+    def get_item(self, path: pathType) -> itemType:
+        return self.to_pan_item(self.db.get_item(path))
+
+    def iter_search_items(self, **kwargs):
+        for item in self.db.iter_search_items(**kwargs):
+            yield self.to_pan_item(item)
+
+    def refresh(self, path: pathType = None, full: bool = False) -> dict:
+        # 广度优先并行列出目录, 在主线程中逐个目录与镜像同步; 起点目录及 mtime 变化的目录才逐项比对
+        # full 为 True 时所有目录都逐项比对
+        path = path if path is not None else self.pan.base_path
+        stat = {"listed": 0, "added": 0, "removed": 0}
+        mtimes = dict(
+            self.db.session.execute(text("SELECT path, mtime FROM mirror_dirs")).all()
+        )
+        self.db.session.commit()
+        root = "/" + str(self.pan.get_relative_path(path))
+        with ThreadPoolExecutor(max_workers=self.pan.workers) as pool:
+            pending = {
+                pool.submit(self.pan.get_dir_list_uncached, root): (
+                    root,
+                    mtimes.get(root, 0),
+                    True,
+                )
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir, mtime, changed = pending.pop(future)
+                    try:
+                        items = future.result()
+                    except pathNotFoundError:
+                        self.remove_path(dir)
+                        continue
+                    stat["listed"] += 1
+                    if changed:
+                        children = self.sync_dir(dir, items, stat)
+                    else:
+                        children = [
+                            (
+                                dir.rstrip("/") + "/" + item["path"].rsplit("/", 1)[-1],
+                                item.get("server_mtime", 0),
+                            )
+                            for item in items
+                            if item["isdir"] == 1
+                        ]
+                    for child, child_mtime in children:
+                        pending[pool.submit(self.pan.get_dir_list_uncached, child)] = (
+                            child,
+                            child_mtime,
+                            full or mtimes.get(child) != child_mtime,
+                        )
+                    if changed:
+                        self.db.session.execute(
+                            text(
+                                "INSERT OR REPLACE INTO mirror_dirs (path, mtime)"
+                                " VALUES (:path, :mtime)"
+                            ),
+                            {"path": dir, "mtime": mtime},
+                        )
+                        self.db.session.commit()
+        return stat
+
+    def dir_path(self, dir: str) -> pathType:
+        return self.pan.base_path + pathType.path_from_str(dir, absolute=False)
+
+    def literal_path(self, path: pathType) -> pathType:
+        # 逐级转义名称, 使其中的 [ ] * ? 在 DB 的 parse_wildcard 中按字面匹配
+        r_path = self.pan.get_relative_path(path)
+        return self.pan.base_path + pathType(
+            [glob.escape(name) for name in r_path.path], False
+        )
+
+    def remove_path(self, path_s: str) -> None:
+        path = self.literal_path(self.dir_path(path_s))
+        self.db.remove_item(path, recursive=True, force=True)
+        self.db.session.execute(
+            text("DELETE FROM mirror_dirs WHERE path = :path OR path LIKE :prefix"),
+            {"path": path_s, "prefix": path_s.rstrip("/") + "/%"},
+        )
+        self.db.session.commit()
+
+    def sync_dir(self, dir: str, items: list, stat: dict) -> list:
+        # 使镜像中的目录与服务器列表一致, 返回子目录 [(路径, mtime)]
+        dir_path = self.dir_path(dir)
+        try:
+            existing = {item.name: item for item in self.db.iter_dir(dir_path)}
+        except pathNotFoundError:
+            self.db.add_item(dir_path, 1)
+            existing = {}
+        links = []
+        children = []
+        names = set()
+        for item in items:
+            name = item["path"].rsplit("/", 1)[-1]
+            names.add(name)
+            old = existing.get(name)
+            if old is not None and old.type != item["isdir"]:
+                self.remove_path(dir.rstrip("/") + "/" + name)
+                old = None
+            if item["isdir"] == 1:
+                children.append(
+                    (dir.rstrip("/") + "/" + name, item.get("server_mtime", 0))
+                )
+            elif (
+                old is None
+                or old.data["md5"] != item.get("md5", "")
+                or old.data["size"] != item.get("size", 0)
+            ):
+                links.append(
+                    linkType(
+                        item.get("md5", ""),
+                        "",
+                        int(item.get("size", 0)),
+                        self.pan.get_relative_path(dir_path) + pathType([name], False),
+                    )
+                )
+                if old is None:
+                    stat["added"] += 1
+        for name in existing.keys() - names:
+            self.remove_path(dir.rstrip("/") + "/" + name)
+            stat["removed"] += 1
+        if links:
+            self.db.bulk_add(links, path=self.pan.base_path, policy="overwrite")
+        return children
+
+    def apply(self, method: str, *args, **kwargs) -> None:
+        # 网络上的写操作成功后在镜像中重放; 重放失败时重新列出受影响的上级目录
+        # Pan 已展开通配符, 源路径是具体路径, 需按字面交给 DB
+        replay_args = args
+        if method in ("move_item", "copy_item", "remove_item"):
+            replay_args = (self.literal_path(args[0]),) + args[1:]
+        try:
+            getattr(self.db, method)(*replay_args, **kwargs)
+        except driveError:
+            for path in args:
+                if isinstance(path, pathType) and path in self.pan.base_path:
+                    self.refresh(path.dirname if path != self.pan.base_path else path)
@@ -0,0 +1,163 @@
+import sys
+import zlib
+import struct
+from array import array
+
+# 快照格式: MAGIC 后为若干块, 每块为 4 字节长度 + zlib 压缩的列式数据
+# 每项为 (父项序号, 类型, 名称, 大小, md5, md5_s), 父项序号 -1 表示导出的根目录
+MAGIC = b"RUMSNAP1"
+CHUNK_SIZE = 65536
+
+
+def typed_array(typecode: str, data: bytes = b"") -> array:
+    res = array(typecode)
+    res.frombytes(data)
+    if sys.byteorder != "little":
+        res.byteswap()
+    return res
+
+
+def array_bytes(data: array) -> bytes:
+    if sys.byteorder != "little":
+        data = array(data.typecode, data)
+        data.byteswap()
+    return data.tobytes()
+
+
+def pack_strings(strings: list) -> bytes:
+    blobs = [s.encode("utf-8") for s in strings]
+    return array_bytes(array("I", [len(b) for b in blobs])) + b"".join(blobs)
+
+
+def unpack_strings(data: bytes, offset: int, count: int) -> tuple:
+    lengths = typed_array("I", data[offset : offset + 4 * count])
+    offset += 4 * count
+    strings = []
+    for length in lengths:
+        strings.append(data[offset : offset + length].decode("utf-8"))
+        offset += length
+    return strings, offset
+
+
+def pack_hashes(hashes: list, flags: array, bit: int) -> bytes:
+    # 32 位十六进制的 md5 压缩为 16 字节, 并记录大小写; 其余按字符串保存
+    packed = []
+    others = []
+    for i, value in enumerate(hashes):
+        value = value or ""
+        raw = None
+        if len(value) == 32:
+            try:
+                raw = bytes.fromhex(value)
+            except ValueError:
+                pass
+        if raw is not None and raw.hex() == value:
+            flags[i] |= 1 << bit
+            packed.append(raw)
+        elif raw is not None and raw.hex().upper() == value:
+            flags[i] |= 3 << bit
+            packed.append(raw)
+        else:
+            others.append(value)
+    return struct.pack("<I", len(packed)) + b"".join(packed) + pack_strings(others)
+
+
+def unpack_hashes(data: bytes, offset: int, flags: array, bit: int) -> tuple:
+    (count,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    packed = [data[offset + 16 * i : offset + 16 * (i + 1)].hex() for i in range(count)]
+    offset += 16 * count
+    others, offset = unpack_strings(
+        data, offset, sum(1 for flag in flags if not flag & (1 << bit))
+    )
+    hashes = []
+    packed_iter = iter(packed)
+    others_iter = iter(others)
+    for flag in flags:
+        if flag & (1 << bit):
+            value = next(packed_iter)
+            hashes.append(value.upper() if flag & (2 << bit) else value)
+        else:
+            hashes.append(next(others_iter))
+    return hashes, offset
+
+
+def pack_chunk(rows: list) -> bytes:
+    flags = array("B", [0] * len(rows))
+    data = [
+        struct.pack("<I", len(rows)),
+        array_bytes(array("q", [row[0] for row in rows])),
+        array_bytes(array("B", [row[1] for row in rows])),
+        array_bytes(array("q", [int(row[3] or 0) for row in rows])),
+        pack_strings([row[2] for row in rows]),
+    ]
+    data.append(pack_hashes([row[4] for row in rows], flags, 0))
+    data.append(pack_hashes([row[5] for row in rows], flags, 2))
+    data.insert(3, array_bytes(flags))
+    payload = zlib.compress(b"".join(data), 1)
+    return struct.pack("<I", len(payload)) + payload
+
+
+def unpack_chunk(payload: bytes) -> list:
+    # 截断或损坏的块统一报告为 ValueError
+    try:
+        rows, complete = unpack_rows(zlib.decompress(payload))
+    except (zlib.error, struct.error, UnicodeDecodeError, StopIteration, ValueError):
+        raise ValueError("Corrupt snapshot file")
+    if not complete:
+        raise ValueError("Corrupt snapshot file")
+    return rows
+
+
+def unpack_rows(data: bytes) -> tuple:
+    # 返回 (各项, 数据是否恰好完整)
+    (count,) = struct.unpack_from("<I", data, 0)
+    offset = 4
+    parents = typed_array("q", data[offset : offset + 8 * count])
+    offset += 8 * count
+    types = typed_array("B", data[offset : offset + count])
+    offset += count
+    flags = typed_array("B", data[offset : offset + count])
+    offset += count
+    sizes = typed_array("q", data[offset : offset + 8 * count])
+    offset += 8 * count
+    names, offset = unpack_strings(data, offset, count)
+    md5s, offset = unpack_hashes(data, offset, flags, 0)
+    md5_ss, offset = unpack_hashes(data, offset, flags, 2)
+    complete = offset == len(data) and all(
+        len(column) == count
+        for column in (parents, types, flags, sizes, names, md5s, md5_ss)
+    )
+    return list(zip(parents, types, names, sizes, md5s, md5_ss)), complete
+
+
+def write_snapshot(f, rows) -> int:
+    f.write(MAGIC)
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            f.write(pack_chunk(chunk))
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        f.write(pack_chunk(chunk))
+        count += len(chunk)
+    return count
+
+
+def read_snapshot(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a snapshot file")
+    while True:
+        header = f.read(4)
+        if not header:
+            break
+        if len(header) < 4:
+            raise ValueError("Corrupt snapshot file")
+        (length,) = struct.unpack("<I", header)
+        payload = f.read(length)
+        if len(payload) < length:
+            raise ValueError("Corrupt snapshot file")
+        yield unpack_chunk(payload)
@@ -0,0 +1,344 @@
+import threading
+import pytest
+from dbUtil import DB, Items
+from helperType import pathType, linkType
+from driveInterface import driveError, driveUnion
+
+P = pathType.path_from_str
+
+
+def make_db(tmp_path, **kwargs) -> DB:
+    return DB(P("/d"), str(tmp_path / "items.db"), **kwargs)
+
+
+def test_concurrent_search_then_read(tmp_path):
+    db = make_db(tmp_path, concurrent=True)
+    db.bulk_add([linkType("a" * 32, "", 1, P("x/old.txt"))], path=P("/d"))
+    assert [item.name for item in db.search_items(name="*.txt")] == ["old.txt"]
+    # 搜索结束后本线程不应停留在旧快照上
+    writer = threading.Thread(
+        target=db.add_item,
+        args=(P("/d/x/new.txt"), 0),
+        kwargs={"size": 2, "md5": "b" * 32, "md5_s": ""},
+    )
+    writer.start()
+    writer.join()
+    assert db.get_item(P("/d/x/new.txt")).data["size"] == 2
+
+
+def snapshot(db: DB) -> list:
+    return [
+        (str(item.path), item.data["total_size"], item.data["file_count"])
+        for item in db.search_items(path=P("/d"))
+    ]
+
+
+def test_move_onto_existing_name_changes_nothing(tmp_path):
+    for concurrent in (False, True):
+        db = DB(
+            P("/d"),
+            str(tmp_path / "move{}.db".format(concurrent)),
+            concurrent=concurrent,
+        )
+        db.bulk_add(
+            [
+                linkType("a" * 32, "", 10, P("a/f.txt")),
+                linkType("b" * 32, "", 5, P("b/a/g.txt")),
+            ],
+            path=P("/d"),
+        )
+        before = snapshot(db)
+        try:
+            db.move_item(P("/d/a"), P("/d/b"))
+            assert False, "expected 603"
+        except driveError as e:
+            assert e.code == 603
+        assert snapshot(db) == before
+        db.add_item(P("/d/c"), 1)
+        db.move_item(P("/d/a/f.txt"), P("/d/c"))
+        assert db.get_item(P("/d/c")).data["total_size"] == 10
+        assert db.get_item(P("/d/a")).data["file_count"] == 0
+
+
+def test_file_is_not_a_directory(tmp_path):
+    db = make_db(tmp_path, memory_index=True)
+    db.bulk_add(
+        [
+            linkType("a" * 32, "", 1, P("f.txt")),
+            linkType("b" * 32, "", 2, P("dir/g.txt")),
+        ],
+        path=P("/d"),
+    )
+    for action in (
+        lambda: db.add_item(P("/d/f.txt/x/y"), 1),
+        lambda: db.move_item(P("/d/dir/g.txt"), P("/d/f.txt/g.txt")),
+        lambda: db.copy_item(P("/d/dir"), P("/d/f.txt/dir"), recursive=True),
+    ):
+        try:
+            action()
+            assert False, "expected 604"
+        except driveError as e:
+            assert e.code == 604
+    assert db.get_item(P("/d/dir/g.txt")).data["size"] == 2
+
+
+def test_memory_index_tolerates_file_parents(tmp_path):
+    db = make_db(tmp_path, memory_index=True)
+    db.bulk_add([linkType("a" * 32, "", 1, P("f.txt"))], path=P("/d"))
+    # 旧版本可能写入父项是文件的行
+    parent = db.path_to_id(P("/d/f.txt"))
+    db.insert_item(parent, "orphan.txt", 0, size=3)
+    db.session.commit()
+    db.index = None
+    assert [item.name for item in db.search_items(name="*.txt")] == ["f.txt"]
+
+
+def test_import_corrupt_snapshot(tmp_path):
+    db = make_db(tmp_path)
+    db.bulk_add(
+        [
+            linkType("%032x" % i, "", i, P("s/d{}/f{}".format(i % 3, i)))
+            for i in range(50)
+        ],
+        path=P("/d"),
+    )
+    with open(tmp_path / "snap", "wb") as f:
+        db.export_snapshot(f, P("/d/s"))
+    data = (tmp_path / "snap").read_bytes()
+    before = snapshot(db)
+    broken = [data[:n] for n in (10, 14, len(data) // 2, len(data) - 1)]
+    broken.append(data[:20] + bytes(b ^ 0xFF for b in data[20:40]) + data[40:])
+    for i, content in enumerate(broken):
+        (tmp_path / "bad").write_bytes(content)
+        with open(tmp_path / "bad", "rb") as f:
+            with pytest.raises(ValueError):
+                db.import_snapshot(f, P("/d/t{}".format(i)))
+    assert snapshot(db) == before
+
+
+def test_memory_index_search_after_write(tmp_path, monkeypatch):
+    db = make_db(tmp_path, memory_index=True)
+    db.bulk_add([linkType("a" * 32, "", 1, P("x/a.txt"))], path=P("/d"))
+    assert [item.name for item in db.search_items(name="*.txt")] == ["a.txt"]
+    db.add_item(P("/d/x/b.txt"), 0, size=2, md5="b" * 32, md5_s="")
+    db.move_item(P("/d/x/a.txt"), P("/d/a.txt"))
+
+    def no_sql(**kwargs):
+        raise AssertionError("search fell back to SQL")
+
+    monkeypatch.setattr(db, "search_query", no_sql)
+    assert sorted(str(item.path) for item in db.search_items(name="*.txt")) == [
+        "/d/a.txt",
+        "/d/x/b.txt",
+    ]
+    assert not db.index.dirty
+
+
+def test_copy_subtree_remaps_ids(tmp_path):
+    db = make_db(tmp_path)
+    db.bulk_add(
+        [
+            linkType("a" * 32, "", 1, P("src/f.txt")),
+            linkType("b" * 32, "", 2, P("src/x/g.txt")),
+            linkType("c" * 32, "", 4, P("src/x/y/h.txt")),
+        ],
+        path=P("/d"),
+    )
+    old_ids = {row.id for row in db.session.query(Items.id)}
+    db.copy_item(P("/d/src"), P("/d/dst"), recursive=True)
+    rows = {row.id: row for row in db.session.query(Items)}
+    copied = [row for id, row in rows.items() if id not in old_ids]
+    assert sorted(str(db.id_to_path(row.id)) for row in copied) == [
+        "dst",
+        "dst/f.txt",
+        "dst/x",
+        "dst/x/g.txt",
+        "dst/x/y",
+        "dst/x/y/h.txt",
+    ]
+    for row in copied:
+        parent_path = rows[row.parent_id].id_path if row.parent_id else "/"
+        assert row.id_path == parent_path.rstrip("/") + "/" + str(row.id)
+        # 除复制根以外, 上级都是新复制的目录
+        assert (row.name == "dst") == (row.parent_id in old_ids or row.parent_id == 0)
+    assert ("/d/dst", 7, 3) in snapshot(db)
+    assert ("/d/src", 7, 3) in snapshot(db)
+
+
+def recount(db: DB) -> list:
+    # 由文件行重新统计每个目录的大小与文件数
+    rows = db.session.query(Items).all()
+    totals = {row.id: [0, 0] for row in rows if row.type == 1}
+    for row in rows:
+        if row.type == 0:
+            for i in row.id_path.strip("/").split("/")[:-1]:
+                totals[int(i)][0] += row.size
+                totals[int(i)][1] += 1
+    return sorted(
+        (str(db.id_to_path(id)), size, count) for id, (size, count) in totals.items()
+    )
+
+
+def stored_totals(db: DB) -> list:
+    return sorted(
+        (str(db.id_to_path(row.id)), row.total_size, row.file_count)
+        for row in db.session.query(Items).filter_by(type=1)
+    )
+
+
+def test_totals_follow_writes(tmp_path):
+    db = make_db(tmp_path)
+    db.bulk_add(
+        [
+            linkType("a" * 32, "", 10, P("a/f.txt")),
+            linkType("b" * 32, "", 20, P("a/x/g.txt")),
+            linkType("c" * 32, "", 40, P("b/h.txt")),
+        ],
+        path=P("/d"),
+    )
+    steps = [
+        lambda: db.add_item(P("/d/a/x/y/new.txt"), 0, size=5, md5="d" * 32),
+        lambda: db.add_item(P("/d/a/f.txt"), 0, size=1, md5="e" * 32, force=True),
+        lambda: db.move_item(P("/d/a/x"), P("/d/b")),
+        lambda: db.copy_item(P("/d/b"), P("/d/c"), recursive=True),
+        lambda: db.add_item(P("/d/c/h.txt"), 0, size=3, md5="f" * 32, force=True),
+        lambda: db.copy_item(P("/d/c/*"), P("/d/b"), recursive=True, force=True),
+        lambda: db.remove_item(P("/d/b/x"), recursive=True),
+    ]
+    for step in steps:
+        step()
+        assert stored_totals(db) == recount(db)
+    assert list(db.disk_usage(P("/d"), depth=1)) == [
+        (P("/d"), 32, 5),
+        (P("/d/a"), 1, 1),
+        (P("/d/b"), 3, 1),
+        (P("/d/c"), 28, 3),
+    ]
+
+
+def test_name_index_matches_like(tmp_path):
+    names = ["ab", "abc.txt", "xabcx.mkv", "ABC.TXT", "a_b.txt", "电影.mkv", "x"]
+    links = [
+        linkType("%032x" % i, "", i, P("dir{}/{}".format(i % 2, name)))
+        for i, name in enumerate(names)
+    ]
+    dbs = []
+    for name_index in (True, False):
+        db = DB(
+            P("/d"),
+            str(tmp_path / "names{}.db".format(name_index)),
+            name_index=name_index,
+        )
+        db.bulk_add(links, path=P("/d"))
+        db.add_item(P("/d/dir1/abcd.mkv"), 0, size=1, md5="f" * 32)
+        db.remove_item(P("/d/dir0/xabcx.mkv"))
+        dbs.append(db)
+    for pattern in ("a*", "*b*", "?b", "*abc*", "*bc.*", "a_b*", "*影*", "x", "*.mkv"):
+        results = [
+            sorted(str(item.path) for item in db.search_items(name=pattern))
+            for db in dbs
+        ]
+        assert results[0] == results[1], pattern
+    assert sorted(str(item.path) for item in dbs[0].search_items(name="*abc*")) == [
+        "/d/dir1/ABC.TXT",
+        "/d/dir1/abc.txt",
+        "/d/dir1/abcd.mkv",
+    ]
+
+
+def test_bulk_add_policies(tmp_path):
+    db = make_db(tmp_path)
+    first = [
+        linkType("a" * 32, "", 1, P("x/a.txt")),
+        linkType("b" * 32, "", 2, P("x/b.txt")),
+        linkType("c" * 32, "", 4, P("f")),
+    ]
+    assert db.bulk_add(first, path=P("/d")) == {
+        "added": 3,
+        "skipped": 0,
+        "overwritten": 0,
+    }
+    second = [
+        linkType("d" * 32, "", 8, P("x/a.txt")),
+        linkType("e" * 32, "", 16, P("x/new.txt")),
+        linkType("f" * 32, "", 32, P("f/under_file.txt")),
+    ]
+    assert db.bulk_add(second, path=P("/d"), policy="skip") == {
+        "added": 1,
+        "skipped": 2,
+        "overwritten": 0,
+    }
+    assert db.get_item(P("/d/x/a.txt")).data["md5"] == "a" * 32
+    assert db.bulk_add(second[:2], path=P("/d"), policy="overwrite") == {
+        "added": 0,
+        "skipped": 0,
+        "overwritten": 2,
+    }
+    assert db.get_item(P("/d/x/a.txt")).data["md5"] == "d" * 32
+    assert ("/d/x", 26, 3) in snapshot(db)
+    for links, code in ((second[:1], 603), (second[2:], 604)):
+        with pytest.raises(driveError) as info:
+            db.bulk_add(links, path=P("/d"), policy="fail")
+        assert info.value.code == code
+    with pytest.raises(ValueError):
+        db.bulk_add(first, path=P("/d"), policy="merge")
+    assert stored_totals(db) == recount(db)
+
+
+def test_bulk_add_fail_is_atomic(tmp_path):
+    db = make_db(tmp_path)
+    db.bulk_add([linkType("a" * 32, "", 1, P("x/taken.txt"))], path=P("/d"))
+    before = snapshot(db)
+    links = [linkType("%032x" % i, "", i, P("x/f{}".format(i))) for i in range(10)]
+    links.append(linkType("b" * 32, "", 1, P("x/taken.txt")))
+    with pytest.raises(driveError):
+        db.bulk_add(links, path=P("/d"), policy="fail", batch_size=2, commit_size=3)
+    assert snapshot(db) == before
+    assert db.bulk_add(links, path=P("/d"), batch_size=2, commit_size=3) == {
+        "added": 10,
+        "skipped": 1,
+        "overwritten": 0,
+    }
+
+
+def test_union_bulk_add_at_root(tmp_path):
+    a = DB(P("/a"), str(tmp_path / "a.db"))
+    b = DB(P("/b"), str(tmp_path / "b.db"))
+    union = driveUnion(P("/"), a, b)
+    links = [
+        "{}##1#a/x/f.txt".format("a" * 32),
+        "{}##2#b/g.txt".format("b" * 32),
+        "{}##4#b/h.txt".format("c" * 32),
+    ]
+    assert union.bulk_add(links, path=P("/"), dirs=[P("/b/empty")]) == {
+        "added": 3,
+        "skipped": 0,
+        "overwritten": 0,
+    }
+    assert a.get_item(P("/a/x/f.txt")).data["size"] == 1
+    assert sorted(item.name for item in b.list_dir(P("/b"))) == [
+        "empty",
+        "g.txt",
+        "h.txt",
+    ]
+    with pytest.raises(driveError) as info:
+        union.bulk_add(["{}##1#c/f.txt".format("d" * 32)], path=P("/"))
+    assert info.value.code == 600
+
+
+def test_export_skips_rows_under_files(tmp_path):
+    db = make_db(tmp_path)
+    db.bulk_add(
+        [linkType("a" * 32, "", 1, P("s/f.txt")), linkType("b" * 32, "", 2, P("s/g"))],
+        path=P("/d"),
+    )
+    # 旧版本可能写入父项是文件的行
+    parent = db.path_to_id(P("/d/s/f.txt"))
+    orphan = db.insert_item(parent, "orphan", 1)
+    db.insert_item(orphan, "deeper.txt", 0, size=3)
+    db.session.commit()
+    with open(tmp_path / "snap", "wb") as f:
+        assert db.export_snapshot(f, P("/d/s")) == 2
+    with open(tmp_path / "snap", "rb") as f:
+        assert db.import_snapshot(f, P("/d/t")) == 2
+    assert sorted(item.name for item in db.list_dir(P("/d/t"))) == ["f.txt", "g"]
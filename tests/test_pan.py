@@ -0,0 +1,220 @@
+import random
+import pytest
+import baiduUtil
+from sqlalchemy import text
+from fakeBaidu import fakeBaidu
+from baiduUtil import Pan
+from driveInterface import driveError, pathNotFoundError
+from helperType import pathType, linkType, rateLimiter
+
+P = pathType.path_from_str
+
+
+@pytest.fixture
+def fake():
+    fake = fakeBaidu()
+    fake.serve()
+    yield fake
+    fake.shutdown()
+
+
+def make_pan(fake: fakeBaidu, **kwargs) -> Pan:
+    kwargs.setdefault("cache_ttl", 0)
+    return Pan(
+        P("/pan"),
+        "",
+        api_base=fake.api_base,
+        share_base=fake.share_base,
+        **kwargs,
+    )
+
+
+def test_mirror_refresh_sees_deep_changes(fake, tmp_path):
+    fake.add_file("/a/b/c/old.txt", "a" * 32, 1)
+    pan = make_pan(fake, mirror=str(tmp_path / "mirror.db"))
+    pan.mirror.refresh()
+    assert pan.use_mirror()
+    # 只有 /a/b/c 的 mtime 变化, /a 与 /a/b 不变
+    fake.remove("/a/b/c/old.txt")
+    fake.add_file("/a/b/c/new.txt", "b" * 32, 2)
+    stat = pan.mirror.refresh()
+    assert stat["added"] == 1 and stat["removed"] == 1
+    assert [item.name for item in pan.list_dir(P("/pan/a/b/c"))] == ["new.txt"]
+
+
+def test_paged_listing(fake):
+    fake.page_size = 100
+    for i in range(450):
+        fake.add_file("/big/f{:03d}".format(i), "%032x" % i, i)
+    pan = make_pan(fake, page_size=100, workers=2)
+    names = [item.name for item in pan.list_dir(P("/pan/big"))]
+    assert names == ["f{:03d}".format(i) for i in range(450)]
+    assert 5 <= fake.counts()["list"] <= 7
+
+
+def test_chunked_file_manager_partial_failures(fake, monkeypatch):
+    monkeypatch.setattr(baiduUtil, "FILEMANAGER_BATCH_SIZE", 10)
+    monkeypatch.setattr(baiduUtil, "FILEMANAGER_SYNC_LIMIT", 5)
+    for i in range(25):
+        if i % 10 != 3:
+            fake.add_file("/src/f{:02d}".format(i), "%032x" % i, i)
+    fake.mkdirs("/dst")
+    pan = make_pan(fake)
+    filelist = [
+        {
+            "path": "/src/f{:02d}".format(i),
+            "dest": "/dst",
+            "newname": "f{:02d}".format(i),
+        }
+        for i in range(25)
+    ]
+    with pytest.raises(pathNotFoundError) as info:
+        pan.file_manager("move", filelist)
+    assert [f["path"] for f in info.value.data["failures"]] == [
+        "/src/f03",
+        "/src/f13",
+        "/src/f23",
+    ]
+    assert fake.counts()["filemanager"] == 3
+    assert fake.counts()["taskquery"] >= 3
+    assert len(fake.nodes["/dst"]["children"]) == 22
+    assert not fake.nodes["/src"]["children"]
+
+
+def test_throttle_back_off(fake):
+    random.seed(3)
+    fake.throttle = 0.3
+    pan = make_pan(fake)
+    pan.limiter = rateLimiter(100, backoff=0.01)
+    for i in range(30):
+        pan.rapid_upload(
+            "/up/f{}".format(i), {"md5": "%032x" % i, "md5_s": "", "size": 1}
+        )
+    assert len(fake.nodes["/up"]["children"]) == 30
+    assert fake.counts()["rapidupload"] > 30
+    # 一直被限流时重试 REQUEST_RETRIES 次后放弃, 速率降低
+    fake.throttle = 1
+    fake.reset_stats()
+    with pytest.raises(driveError) as info:
+        pan.rapid_upload("/up/last", {"md5": "f" * 32, "md5_s": "", "size": 1})
+    assert info.value.code == 111
+    assert fake.counts()["rapidupload"] == baiduUtil.REQUEST_RETRIES
+    assert pan.limiter.rate < 100
+
+
+def test_upload_cache_skips_dead_hashes(fake, tmp_path):
+    fake.known = {"a" * 32}
+    cache_file = str(tmp_path / "upload.db")
+    pan = make_pan(fake, upload_cache=cache_file)
+    dead = {"md5": "B" * 32, "md5_s": "", "size": 1}
+    for attempt in range(2):
+        with pytest.raises(driveError) as info:
+            pan.rapid_upload("/up/dead{}".format(attempt), dead)
+        assert info.value.code == 404
+    pan.rapid_upload("/up/ok", {"md5": "a" * 32, "md5_s": "", "size": 1})
+    assert fake.counts()["rapidupload"] == 2
+    # 跨会话保留失败记录, 不保存成功的记录
+    pan = make_pan(fake, upload_cache=cache_file)
+    with pytest.raises(driveError):
+        pan.rapid_upload("/up/dead2", dead)
+    assert fake.counts()["rapidupload"] == 2
+    with pan.upload_cache.sql.connect() as conn:
+        rows = conn.execute(text("SELECT md5 FROM rapid_hashes")).all()
+    assert rows == [("b" * 32,)]
+
+
+def test_mirror_replays_bracketed_names_literally(fake, tmp_path):
+    fake.add_file("/m/Movie [1080p].mkv", "a" * 32, 1)
+    fake.add_file("/m/Movie 1.mkv", "b" * 32, 2)
+    fake.add_file("/m/x[1]/Movie 1.mkv", "c" * 32, 3)
+    fake.mkdirs("/n")
+    pan = make_pan(fake, mirror=str(tmp_path / "mirror.db"))
+    pan.mirror.refresh()
+    pan.move_item(P("/pan/m/*p].mkv"), P("/pan/n"))
+    pan.remove_item(P("/pan/m/x[[]1]/Movie 1.mkv"))
+    assert sorted(fake.nodes["/m"]["children"]) == ["Movie 1.mkv", "x[1]"]
+    assert [item.name for item in pan.list_dir(P("/pan/m"))] == ["x[1]", "Movie 1.mkv"]
+    assert [item.name for item in pan.list_dir(P("/pan/n"))] == ["Movie [1080p].mkv"]
+    assert pan.list_dir(P("/pan/m/x[1]")) == []
+
+
+def test_asyncio_transport(fake):
+    pytest.importorskip("aiohttp")
+    fake.page_size = 100
+    for i in range(250):
+        fake.add_file("/big/f{:03d}".format(i), "%032x" % i, i)
+    pan = make_pan(fake, transport="asyncio", page_size=100)
+    try:
+        names = [item.name for item in pan.list_dir(P("/pan/big"))]
+        assert names == ["f{:03d}".format(i) for i in range(250)]
+        links = [
+            linkType("%032x" % i, "", i, P("a/f{}".format(i), absolute=False))
+            for i in range(20)
+        ]
+        stat = pan.bulk_add(links, path=P("/pan/up"))
+        assert stat["added"] == 20
+        fake.mkdirs("/moved")
+        pan.move_item(P("/pan/up/a/*"), P("/pan/moved"))
+        assert len(fake.nodes["/moved"]["children"]) == 20
+        assert not fake.nodes["/up/a"]["children"]
+    finally:
+        pan.transport.close()
+
+
+def test_create_dirs_only_missing(fake):
+    fake.mkdirs("/a/b")
+    fake.add_file("/a/f", "a" * 32, 1)
+    pan = make_pan(fake)
+    created = pan.create_dirs(
+        [P("/pan/a/b/c/d"), P("/pan/a/e"), P("/pan/a/b"), P("/pan/a/b/c")]
+    )
+    assert [str(path) for path in created] == [
+        "/pan/a/b/c",
+        "/pan/a/b/c/d",
+        "/pan/a/e",
+    ]
+    assert fake.counts()["create"] == 3
+    # 新建目录的子目录不再列出
+    assert fake.counts()["list"] == 3
+    assert fake.nodes["/a/b/c/d"]["isdir"] == 1
+    fake.reset_stats()
+    errors = []
+    created = pan.create_dirs(
+        [P("/pan/a/f/x"), P("/pan/a/g")],
+        report=lambda path, error: errors.append((str(path), error.code)),
+    )
+    assert [str(path) for path in created] == ["/pan/a/g"]
+    assert errors == [("/pan/a/f", 604)]
+    assert fake.counts()["create"] == 1
+
+
+def test_listing_cache_invalidated_by_writes(fake):
+    fake.add_file("/a/f1", "a" * 32, 1)
+    fake.add_file("/a/sub/f2", "b" * 32, 2)
+    fake.mkdirs("/b")
+    pan = make_pan(fake, cache_ttl=600)
+
+    def names(path: str) -> list:
+        return sorted(item.name for item in pan.list_dir(P(path)))
+
+    assert names("/pan/a") == ["f1", "sub"]
+    assert names("/pan/a/sub") == ["f2"]
+    assert names("/pan/b") == []
+    assert pan.get_item(P("/pan/a/f1")).data["size"] == 1
+    listed = fake.counts()["list"]
+    assert names("/pan/a") == ["f1", "sub"]
+    assert fake.counts()["list"] == listed
+    pan.add_item(P("/pan/a/new/deep"), 1)
+    assert names("/pan/a") == ["f1", "new", "sub"]
+    pan.move_item(P("/pan/a/sub"), P("/pan/b"))
+    assert names("/pan/a") == ["f1", "new"]
+    assert names("/pan/b") == ["sub"]
+    assert names("/pan/b/sub") == ["f2"]
+    with pytest.raises(pathNotFoundError):
+        pan.list_dir(P("/pan/a/sub"))
+    pan.copy_item(P("/pan/a/f1"), P("/pan/b/f1"))
+    pan.remove_item(P("/pan/a/f1"))
+    assert names("/pan/a") == ["new"]
+    assert names("/pan/b") == ["f1", "sub"]
+    with pytest.raises(pathNotFoundError):
+        pan.get_item(P("/pan/a/f1"))
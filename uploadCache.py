@@ -0,0 +1,103 @@
+import time
+import threading
+import sqlalchemy
+from sqlalchemy import text
+from helperType import lruCache
+
+
+class uploadCache:
+    # 秒传失败缓存: (md5, md5_s, size) -> 记录时间, 保存在 SQLite 中跨会话使用
+    # 只记录服务器上不存在的哈希, ttl 秒后过期并重新尝试; 秒传成功时删除记录
+    # 按哈希查询主键, 查询结果 (含 "未记录") 由 LRU 缓存
+    def __init__(self, db_file: str, ttl: float = 7 * 86400, cache_size: int = 65536):
+        self.ttl = float(ttl)
+        self.sql = sqlalchemy.create_engine(
+            f"sqlite:///{db_file}", connect_args={"check_same_thread": False}
+        )
+        with self.sql.begin() as conn:
+            conn.execute(
+                text(
+                    "CREATE TABLE IF NOT EXISTS rapid_hashes"
+                    " (md5 VARCHAR, md5_s VARCHAR, size INTEGER, checked REAL,"
+                    " PRIMARY KEY (md5, md5_s, size))"
+                )
+            )
+        self.entries = lruCache(int(cache_size))
+        # 待写入的变化: key -> 记录时间, None 表示删除
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def key(self, file_data: dict) -> tuple:
+        return (
+            file_data["md5"].lower(),
+            file_data["md5_s"].lower(),
+            int(file_data["size"]),
+        )
+
+    def checked(self, key: tuple):
+        # 返回记录时间, 未记录时为 None
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+        entry = self.entries.get(key)
+        if entry is None:
+            with self.sql.connect() as conn:
+                checked = conn.execute(
+                    text(
+                        "SELECT checked FROM rapid_hashes"
+                        " WHERE md5 = :md5 AND md5_s = :md5_s AND size = :size"
+                    ),
+                    {"md5": key[0], "md5_s": key[1], "size": key[2]},
+                ).scalar()
+            entry = (checked,)
+            self.entries.put(key, entry)
+        return entry[0]
+
+    def is_dead(self, file_data: dict) -> bool:
+        checked = self.checked(self.key(file_data))
+        return checked is not None and checked + self.ttl > time.time()
+
+    def record(self, file_data: dict, ok: bool) -> None:
+        key = self.key(file_data)
+        if ok and self.checked(key) is None:
+            return
+        checked = None if ok else time.time()
+        with self.lock:
+            self.pending[key] = checked
+            flush = len(self.pending) >= 1000
+        self.entries.put(key, (checked,))
+        if flush:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        dead = [
+            {"md5": key[0], "md5_s": key[1], "size": key[2], "checked": checked}
+            for key, checked in pending.items()
+            if checked is not None
+        ]
+        alive = [
+            {"md5": key[0], "md5_s": key[1], "size": key[2]}
+            for key, checked in pending.items()
+            if checked is None
+        ]
+        if dead or alive:
+            with self.sql.begin() as conn:
+                if dead:
+                    conn.execute(
+                        text(
+                            "INSERT OR REPLACE INTO rapid_hashes"
+                            " (md5, md5_s, size, checked)"
+                            " VALUES (:md5, :md5_s, :size, :checked)"
+                        ),
+                        dead,
+                    )
+                if alive:
+                    conn.execute(
+                        text(
+                            "DELETE FROM rapid_hashes"
+                            " WHERE md5 = :md5 AND md5_s = :md5_s AND size = :size"
+                        ),
+                        alive,
+                    )